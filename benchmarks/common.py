@@ -0,0 +1,31 @@
+"""Set-up and helpers shared by the benchmark scripts.
+
+Call setup() before importing main: it puts the repository root on sys.path, makes it the
+working directory (main.py serves ./static) and gives main.py's required settings placeholder
+values, so the scripts run without a .env.
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PLACEHOLDER_ENV = {
+    "REDIS_URL": "redis://localhost:6379",
+    "TWILIO_ACCOUNT_SID": "AC" + "0" * 32,
+    "TWILIO_AUTH_TOKEN": "benchmark",
+    "OPENAI_API_KEY": "benchmark",
+}
+
+
+def setup(placeholder_env=True):
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    if placeholder_env:
+        for name, value in PLACEHOLDER_ENV.items():
+            os.environ.setdefault(name, value)
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
@@ -0,0 +1,242 @@
+"""Local stand-ins for the OpenAI Realtime API, the CustomGPT REST API and the Twilio REST API.
+
+The fake realtime server speaks just enough of the realtime protocol for handle_media_stream:
+it answers session.update, streams scripted response.audio.delta events for every
+response.create, and every few seconds of caller audio plays out a turn (speech_started,
+speech_stopped, then a get_additional_context function call).
+
+Audio payloads carry a small header (see stamp_audio) with the call index and a
+time.monotonic() timestamp, so relay latency can be measured on the other side of the app.
+Caller frames are stamped when sent. Response audio is stamped with the moment it is due to
+play if the response were played in real time from its first chunk, because the app
+deliberately paces outbound audio; what matters there is lateness against playback.
+"""
+import asyncio
+import base64
+import json
+import struct
+import time
+
+import websockets
+from aiohttp import web
+
+STAMP = struct.Struct('>4sId')
+STAMP_MAGIC = b'LTST'
+# One 20 ms frame of 8 kHz g711_ulaw.
+FRAME_BYTES = 160
+FRAMES_PER_SECOND = 50
+ULAW_SILENCE = b'\xff'
+
+
+def stamp_audio(call_index, size, sent_at=None):
+    header = STAMP.pack(STAMP_MAGIC, call_index, time.monotonic() if sent_at is None else sent_at)
+    return base64.b64encode(header + ULAW_SILENCE * (size - len(header))).decode('utf-8')
+
+
+def read_stamp(payload):
+    """(call_index, sent_at) of a stamped base64 payload, or None for foreign audio."""
+    raw = base64.b64decode(payload[:24])
+    if len(raw) < STAMP.size or not raw.startswith(STAMP_MAGIC):
+        return None
+    _, call_index, sent_at = STAMP.unpack_from(raw)
+    return call_index, sent_at
+
+
+def compact(event):
+    return json.dumps(event, separators=(',', ':'))
+
+
+class FakeRealtimeServer:
+    """Scripted stand-in for wss://api.openai.com/v1/realtime."""
+
+    def __init__(self, greeting_seconds=2.0, answer_seconds=4.0, turn_every=6.0,
+                 delta_ms=100, speed=2.0, unique_queries=True):
+        self.greeting_seconds = greeting_seconds
+        self.answer_seconds = answer_seconds
+        self.turn_every = turn_every
+        self.delta_bytes = FRAME_BYTES * delta_ms // 20
+        self.speed = speed
+        self.unique_queries = unique_queries
+        self.inbound_latencies = []
+        # call index -> time.monotonic() of the last speech_started, for barge-in latency.
+        self.speech_started_at = {}
+        self.function_calls = 0
+        self.connections = 0
+        self.server = None
+
+    async def start(self, host='127.0.0.1', port=0):
+        self.server = await websockets.serve(self.handle, host, port, max_size=None)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, ws):
+        self.connections += 1
+        call = {"index": None, "frames": 0, "turns": 0, "responses": 0, "stream": None}
+        await ws.send(compact({"type": "session.created"}))
+        try:
+            async for message in ws:
+                event = json.loads(message)
+                kind = event['type']
+                if kind == 'session.update':
+                    await ws.send(compact({"type": "session.updated"}))
+                elif kind == 'input_audio_buffer.append':
+                    await self.on_append(ws, call, event['audio'])
+                elif kind == 'response.create':
+                    greeting = call["responses"] == 0
+                    call["responses"] += 1
+                    self.cancel_stream(call)
+                    call["stream"] = asyncio.create_task(self.stream_response(
+                        ws, call, self.greeting_seconds if greeting else self.answer_seconds, stamped=not greeting))
+                elif kind == 'response.cancel':
+                    self.cancel_stream(call)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            self.cancel_stream(call)
+
+    def cancel_stream(self, call):
+        if call["stream"] is not None and not call["stream"].done():
+            call["stream"].cancel()
+        call["stream"] = None
+
+    async def on_append(self, ws, call, audio):
+        stamp = read_stamp(audio)
+        if stamp is not None:
+            call["index"] = stamp[0]
+            self.inbound_latencies.append(time.monotonic() - stamp[1])
+        call["frames"] += len(base64.b64decode(audio)) // FRAME_BYTES
+        if self.turn_every and call["frames"] >= FRAMES_PER_SECOND * self.turn_every * (call["turns"] + 1):
+            call["turns"] += 1
+            await self.play_turn(ws, call)
+
+    async def play_turn(self, ws, call):
+        self.speech_started_at[call["index"]] = time.monotonic()
+        await ws.send(compact({"type": "input_audio_buffer.speech_started", "audio_start_ms": 0}))
+        await ws.send(compact({"type": "input_audio_buffer.speech_stopped", "audio_end_ms": 0}))
+        await ws.send(compact({"type": "input_audio_buffer.committed"}))
+        query = "A user asked: what are your opening hours?"
+        if self.unique_queries:
+            query += f" (call {call['index']}, turn {call['turns']})"
+        self.function_calls += 1
+        await ws.send(compact({
+            "type": "response.function_call_arguments.done",
+            "name": "get_additional_context",
+            "call_id": f"call_{call['index']}_{call['turns']}",
+            "arguments": json.dumps({"query": query}),
+        }))
+
+    async def stream_response(self, ws, call, seconds, stamped=True):
+        # The app caches and replays greeting audio, so greetings are left unstamped: a replayed
+        # stamp would report the age of the cache entry as relay latency.
+        response_id = f"resp_{call['index']}_{call['responses']}"
+        chunks = int(seconds * FRAMES_PER_SECOND * FRAME_BYTES / self.delta_bytes)
+        interval = self.delta_bytes / FRAME_BYTES / FRAMES_PER_SECOND / self.speed
+        silence = base64.b64encode(ULAW_SILENCE * self.delta_bytes).decode('utf-8')
+        await ws.send(compact({"type": "response.created", "response": {"id": response_id}}))
+        started = time.monotonic()
+        for chunk in range(chunks):
+            due = started + chunk * self.delta_bytes / FRAME_BYTES / FRAMES_PER_SECOND
+            await ws.send(compact({
+                "type": "response.audio.delta",
+                "event_id": "event_0",
+                "response_id": response_id,
+                "delta": stamp_audio(call["index"] or 0, self.delta_bytes, due) if stamped else silence,
+            }))
+            await asyncio.sleep(interval)
+        await ws.send(compact({"type": "response.audio.done", "response_id": response_id}))
+        await ws.send(compact({"type": "response.audio_transcript.done", "transcript": "Scripted response."}))
+        await ws.send(compact({"type": "response.done", "response": {"id": response_id, "status": "completed"}}))
+
+
+# Longer than the three sentences the voice persona asks for, as CustomGPT answers often are.
+CUSTOMGPT_ANSWER = (
+    "We are open from nine to five, Monday to Friday. On Saturdays we open from ten to two. "
+    "We are closed on Sundays and public holidays. Appointments can be booked online or by phone. "
+    "Walk-ins are welcome when there is space. Please bring your membership card to every visit."
+)
+
+
+class FakeRestServer:
+    """CustomGPT and Twilio REST endpoints answering after a configurable delay.
+
+    A streamed CustomGPT answer (stream=1) starts after customgpt_first_token seconds and then
+    arrives word by word, finishing when the plain response would.
+    """
+
+    def __init__(self, customgpt_latency=1.0, twilio_latency=0.1, customgpt_first_token=0.5):
+        self.customgpt_latency = customgpt_latency
+        self.customgpt_first_token = min(customgpt_first_token, customgpt_latency)
+        self.twilio_latency = twilio_latency
+        self.requests = {"customgpt_messages": 0, "customgpt_streams_closed": 0, "customgpt_conversations": 0, "twilio": 0}
+        self.runner = None
+
+    async def start(self, host='127.0.0.1', port=0):
+        app = web.Application()
+        app.router.add_post("/api/v1/projects/{project_id}/conversations/{session_id}/messages", self.send_message)
+        app.router.add_post("/api/v1/projects/{project_id}/conversations", self.create_conversation)
+        app.router.add_post("/2010-04-01/Accounts/{account_sid}/Calls/{call_sid}/Recordings.json", self.create_recording)
+        app.router.add_post("/2010-04-01/Accounts/{account_sid}/Messages.json", self.create_message)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        return site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    async def send_message(self, request):
+        self.requests["customgpt_messages"] += 1
+        if request.query.get("stream") in ("1", "true"):
+            return await self.stream_message(request)
+        await asyncio.sleep(self.customgpt_latency)
+        return web.json_response({"status": "success", "data": {
+            "openai_response": CUSTOMGPT_ANSWER,
+        }})
+
+    async def stream_message(self, request):
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        words = CUSTOMGPT_ANSWER.split(" ")
+        interval = (self.customgpt_latency - self.customgpt_first_token) / len(words)
+        await asyncio.sleep(self.customgpt_first_token)
+        try:
+            for index, word in enumerate(words):
+                chunk = {"status": "progress", "message": word if index == 0 else " " + word}
+                await response.write(f"event: progress\ndata: {json.dumps(chunk)}\n\n".encode())
+                await asyncio.sleep(interval)
+            finish = {"status": "finish", "citations": [], "openai_response": CUSTOMGPT_ANSWER}
+            await response.write(f"event: finish\ndata: {json.dumps(finish)}\n\n".encode())
+        except ConnectionResetError:
+            # The app read enough and closed the request.
+            self.requests["customgpt_streams_closed"] += 1
+        return response
+
+    async def create_conversation(self, request):
+        self.requests["customgpt_conversations"] += 1
+        conversation = self.requests["customgpt_conversations"]
+        await asyncio.sleep(self.customgpt_latency)
+        session_id = f"fake-{conversation}"
+        return web.json_response({"status": "success", "data": {
+            "id": conversation,
+            "session_id": session_id,
+            "name": "caller",
+            "project_id": int(request.match_info["project_id"]),
+            "created_at": "2024-01-01 00:00:00",
+            "updated_at": "2024-01-01 00:00:00",
+            "deleted_at": None,
+            "user_id": 1,
+        }}, status=201)
+
+    async def create_recording(self, request):
+        self.requests["twilio"] += 1
+        await asyncio.sleep(self.twilio_latency)
+        return web.json_response({"sid": "RE" + "0" * 32, "call_sid": request.match_info["call_sid"]}, status=201)
+
+    async def create_message(self, request):
+        self.requests["twilio"] += 1
+        await asyncio.sleep(self.twilio_latency)
+        return web.json_response({"sid": "SM" + "0" * 32}, status=201)
@@ -0,0 +1,65 @@
+"""Benchmark of streamed knowledge-base answers with early cutoff against the plain request.
+
+Runs get_additional_context against the fake CustomGPT server from benchmarks/fakes.py, whose
+six-sentence answer takes --customgpt-latency seconds in full and, streamed, starts after
+--customgpt-first-token seconds. Reports the time until the answer is ready for the realtime
+model, which is the typing-sound dead air on the call, and how much of the answer is kept.
+
+    python benchmarks/kb_stream_bench.py --queries 20 --customgpt-latency 4
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import common
+
+common.setup()
+
+import fakes  # noqa: E402
+import main  # noqa: E402
+
+
+async def measure(label, queries, streamed):
+    main.KB_STREAM_ENABLED = streamed
+    timings, lengths = [], []
+    for index in range(queries):
+        started = time.perf_counter()
+        answer = await main.get_additional_context(f"A user asked: opening hours {index}", "benchmark", 1, "benchmark")
+        timings.append(time.perf_counter() - started)
+        lengths.append(len(answer))
+    print(f"{label:<28}{statistics.median(timings):>10.2f}{max(timings):>10.2f}{statistics.mean(lengths):>10.0f}")
+
+
+async def run(args):
+    rest = fakes.FakeRestServer(customgpt_latency=args.customgpt_latency, customgpt_first_token=args.customgpt_first_token)
+    main.CUSTOMGPT_BASE_URL = f"http://127.0.0.1:{await rest.start()}"
+    main.KB_STREAM_MAX_SENTENCES = args.max_sentences
+    main.KB_STREAM_MAX_CHARS = args.max_chars
+    main.logger.setLevel("WARNING")
+    try:
+        print(f"answer of {len(fakes.CUSTOMGPT_ANSWER)} chars in {args.customgpt_latency:.1f} s, first token after "
+              f"{args.customgpt_first_token:.1f} s; cutoff {args.max_sentences} sentences or {args.max_chars} chars")
+        print(f"{'knowledge-base request':<28}{'p50 s':>10}{'max s':>10}{'chars':>10}")
+        await measure("plain (stream=0)", args.queries, streamed=False)
+        await measure("streamed, early cutoff", args.queries, streamed=True)
+        # The fake notices a closed stream on its next write.
+        await asyncio.sleep(0.5)
+        print(f"streams closed early: {rest.requests['customgpt_streams_closed']} of {args.queries}")
+    finally:
+        await main.close_http_clients()
+        await rest.stop()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--queries", type=int, default=10)
+    parser.add_argument("--customgpt-latency", type=float, default=4.0)
+    parser.add_argument("--customgpt-first-token", type=float, default=0.8)
+    parser.add_argument("--max-sentences", type=int, default=main.KB_STREAM_MAX_SENTENCES)
+    parser.add_argument("--max-chars", type=int, default=main.KB_STREAM_MAX_CHARS)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main_cli()
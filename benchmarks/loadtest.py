@@ -0,0 +1,286 @@
+"""Load test: how many concurrent calls one UvicornWorker relays before audio degrades.
+
+Starts the stand-ins from benchmarks/fakes.py, launches the app through
+benchmarks/loadtest_app.py (a single uvicorn worker), then drives increasing numbers of
+simulated Twilio media streams against /media-stream/... Each simulated call sends 20 ms
+g711_ulaw frames at real-time pacing and receives the scripted greeting and answers.
+
+Per concurrency level it reports p50/p99 frame-relay latency in both directions (outbound as
+lateness against the real-time playout schedule, since the app paces audio to Twilio), outbound
+jitter, barge-in latency (speech_started to Twilio clear), event-loop lag, and CPU and memory
+per call, and flags the first level that breaks the latency budget.
+
+The app still needs a Redis for call state and caches:
+
+    REDIS_URL=redis://127.0.0.1:6379 REDIS_SSL=false python benchmarks/loadtest.py --levels 1,10,25,50,100
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.parse
+import uuid
+
+import aiohttp
+import websockets
+
+import fakes
+from common import ROOT, percentile
+
+FRAME_INTERVAL = 1 / fakes.FRAMES_PER_SECOND
+
+
+class CallResult:
+    def __init__(self):
+        self.outbound_latencies = []
+        self.barge_in_latencies = []
+        self.jitter = 0.0
+        self.frames_sent = 0
+        self.media_received = 0
+        self.error = None
+
+
+async def simulate_call(app_url, call_index, duration, realtime, webhook):
+    result = CallResult()
+    stream_path = f"/media-stream/project/1/session/{uuid.uuid4()}/%2B15550000000/Hello+there"
+    try:
+        if webhook:
+            stream_path = await place_call(app_url, call_index)
+        ws_url = app_url.replace("http", "ws", 1) + stream_path
+        async with websockets.connect(ws_url, max_size=None) as ws:
+            await ws.send(json.dumps({"event": "connected", "protocol": "Call", "version": "1.0.0"}))
+            await ws.send(json.dumps({"event": "start", "start": {
+                "streamSid": f"MZ{call_index:032d}",
+                "customParameters": {"api_key": "loadtest"},
+            }}))
+            receiver = asyncio.create_task(receive_audio(ws, call_index, realtime, result))
+            await send_audio(ws, call_index, duration, result)
+            receiver.cancel()
+    except Exception as e:
+        result.error = repr(e)
+    return result
+
+
+async def place_call(app_url, call_index):
+    """Drive /incoming-call like Twilio and return the media-stream path from its TwiML."""
+    async with aiohttp.ClientSession() as http:
+        async with http.post(
+            f"{app_url}/incoming-call",
+            params={"project_id": 1, "phone_number": "+15550000000"},
+            data={"From": f"+1555{call_index:07d}", "CallSid": f"CA{call_index:032d}"},
+        ) as response:
+            twiml = await response.text()
+    stream_url = twiml.split('<Stream url="', 1)[1].split('"', 1)[0]
+    return urllib.parse.urlparse(stream_url.replace("&amp;", "&")).path
+
+
+async def send_audio(ws, call_index, duration, result):
+    # Absolute schedule, so a late wake-up does not push every later frame back.
+    started = time.monotonic()
+    frames = int(duration * fakes.FRAMES_PER_SECOND)
+    for frame in range(frames):
+        await asyncio.sleep(max(0.0, started + frame * FRAME_INTERVAL - time.monotonic()))
+        await ws.send(fakes.compact({
+            "event": "media",
+            "sequenceNumber": str(frame + 2),
+            "media": {"track": "inbound", "chunk": str(frame + 1), "timestamp": str(frame * 20),
+                      "payload": fakes.stamp_audio(call_index, fakes.FRAME_BYTES)},
+            "streamSid": f"MZ{call_index:032d}",
+        }))
+        result.frames_sent += 1
+
+
+async def receive_audio(ws, call_index, realtime, result):
+    previous = None
+    async for message in ws:
+        received_at = time.monotonic()
+        event = json.loads(message)
+        if event["event"] == "clear":
+            speech_started_at = realtime.speech_started_at.pop(call_index, None)
+            if speech_started_at is not None:
+                result.barge_in_latencies.append(received_at - speech_started_at)
+        elif event["event"] == "media":
+            result.media_received += 1
+            stamp = fakes.read_stamp(event["media"]["payload"])
+            if stamp is None:
+                # Hold audio and cached greetings are not stamped.
+                continue
+            transit = received_at - stamp[1]
+            # Audio released ahead of its playout time is on time, not negatively late.
+            result.outbound_latencies.append(max(0.0, transit))
+            if previous is not None:
+                # RFC 3550 interarrival jitter estimate.
+                result.jitter += (abs(transit - previous) - result.jitter) / 16
+            previous = transit
+
+
+async def app_stats(http, app_url):
+    try:
+        async with http.get(f"{app_url}/loadtest/stats") as response:
+            return await response.json()
+    except aiohttp.ClientError:
+        return None
+
+
+async def run_level(app_url, concurrency, args, realtime):
+    async with aiohttp.ClientSession() as http:
+        try:
+            await http.post(f"{app_url}/loadtest/reset")
+        except aiohttp.ClientError:
+            pass
+        before = await app_stats(http, app_url)
+        realtime.inbound_latencies.clear()
+        calls = []
+        for call_index in range(concurrency):
+            calls.append(asyncio.create_task(simulate_call(app_url, call_index, args.duration, realtime, args.webhook)))
+            # Spread call setup the way real arrivals would be, rather than one thundering herd.
+            await asyncio.sleep(args.ramp / max(concurrency, 1))
+        results = await asyncio.gather(*calls)
+        after = await app_stats(http, app_url)
+
+    outbound = [latency for result in results for latency in result.outbound_latencies]
+    barge_in = [latency for result in results for latency in result.barge_in_latencies]
+    report = {
+        "calls": concurrency,
+        "errors": sum(1 for result in results if result.error),
+        "outbound_p50_ms": percentile(outbound, 0.5) * 1000,
+        "outbound_p99_ms": percentile(outbound, 0.99) * 1000,
+        "inbound_p50_ms": percentile(realtime.inbound_latencies, 0.5) * 1000,
+        "inbound_p99_ms": percentile(realtime.inbound_latencies, 0.99) * 1000,
+        "jitter_p99_ms": percentile([result.jitter for result in results], 0.99) * 1000,
+        "barge_in_p50_ms": percentile(barge_in, 0.5) * 1000,
+        "barge_in_p99_ms": percentile(barge_in, 0.99) * 1000,
+    }
+    if before and after:
+        report.update({
+            "loop_lag_p99_ms": after["loop_lag_p99"] * 1000,
+            "cpu_ms_per_call_second": (after["cpu_seconds"] - before["cpu_seconds"]) * 1000 / (concurrency * args.duration),
+            "rss_mb": after["rss_bytes"] / 2 ** 20,
+            "rss_kb_per_call": max(0, after["rss_bytes"] - before["rss_bytes"]) / 1024 / concurrency,
+        })
+    report["degraded"] = (
+        report["errors"] > 0
+        or report["outbound_p99_ms"] > args.budget_ms
+        or report["inbound_p99_ms"] > args.budget_ms
+        or report.get("loop_lag_p99_ms", 0) > args.loop_lag_budget_ms
+    )
+    for result in results:
+        if result.error:
+            print(f"  call error: {result.error}")
+    return report
+
+
+def start_app(args, realtime_port, rest_port):
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_API_KEY": env.get("OPENAI_API_KEY", "loadtest"),
+        "TWILIO_ACCOUNT_SID": env.get("TWILIO_ACCOUNT_SID", "AC" + "0" * 32),
+        "TWILIO_AUTH_TOKEN": env.get("TWILIO_AUTH_TOKEN", "loadtest"),
+        "REDIS_URL": env.get("REDIS_URL", "redis://127.0.0.1:6379"),
+        "REDIS_SSL": env.get("REDIS_SSL", "false"),
+        "OPENAI_REALTIME_URL": f"ws://127.0.0.1:{realtime_port}",
+        "CUSTOMGPT_BASE_URL": f"http://127.0.0.1:{rest_port}",
+        "TWILIO_API_BASE_URL": f"http://127.0.0.1:{rest_port}",
+    })
+    if not args.webhook:
+        # No webhook ran for these streams, so no worker is creating their CustomGPT session.
+        env.setdefault("CUSTOMGPT_SESSION_WAIT", "0")
+    return subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "benchmarks", "loadtest_app.py"),
+         "--port", str(args.port), "--log-level", args.app_log_level],
+        env=env,
+    )
+
+
+async def wait_for_app(app_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as http:
+        while time.monotonic() < deadline:
+            try:
+                async with http.get(f"{app_url}/"):
+                    return
+            except aiohttp.ClientError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"App did not come up at {app_url}")
+
+
+def print_report(report):
+    columns = [
+        ("calls", "{:>6}"), ("errors", "{:>6}"),
+        ("outbound_p50_ms", "{:>9.1f}"), ("outbound_p99_ms", "{:>9.1f}"),
+        ("inbound_p50_ms", "{:>9.1f}"), ("inbound_p99_ms", "{:>9.1f}"),
+        ("jitter_p99_ms", "{:>9.1f}"), ("barge_in_p99_ms", "{:>9.1f}"),
+        ("loop_lag_p99_ms", "{:>9.1f}"), ("cpu_ms_per_call_second", "{:>9.2f}"),
+        ("rss_mb", "{:>8.1f}"), ("rss_kb_per_call", "{:>8.0f}"),
+    ]
+    print(" ".join(fmt.format(report[key]) if key in report else " " * len(fmt.format(0)) for key, fmt in columns)
+          + ("  DEGRADED" if report["degraded"] else ""))
+
+
+async def run(args):
+    realtime = fakes.FakeRealtimeServer(
+        greeting_seconds=args.greeting_seconds, answer_seconds=args.answer_seconds,
+        turn_every=args.turn_every, speed=args.tts_speed, unique_queries=not args.repeat_queries,
+    )
+    rest = fakes.FakeRestServer(customgpt_latency=args.customgpt_latency, twilio_latency=args.twilio_latency,
+                                customgpt_first_token=args.customgpt_first_token)
+    realtime_port = await realtime.start()
+    rest_port = await rest.start()
+    app = None
+    app_url = args.app_url
+    if app_url is None:
+        app_url = f"http://127.0.0.1:{args.port}"
+        app = start_app(args, realtime_port, rest_port)
+    else:
+        print(f"Using running app at {app_url}; point it at realtime ws://127.0.0.1:{realtime_port} "
+              f"and REST http://127.0.0.1:{rest_port}")
+    try:
+        await wait_for_app(app_url)
+        print("calls errors  out p50  out p99   in p50   in p99 jit p99 barge p99  lag p99 cpu ms/s   rss MB  KB/call")
+        for concurrency in args.levels:
+            report = await run_level(app_url, concurrency, args, realtime)
+            print_report(report)
+            if report["degraded"] and not args.keep_going:
+                print(f"Audio degrades at {concurrency} concurrent calls "
+                      f"(budget {args.budget_ms:.0f} ms relay, {args.loop_lag_budget_ms:.0f} ms loop lag).")
+                break
+        else:
+            print("No degradation within the tested levels.")
+    finally:
+        if app is not None:
+            app.terminate()
+            app.wait()
+        await realtime.stop()
+        await rest.stop()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--levels", default="1,5,10,25,50,100",
+                        type=lambda value: [int(level) for level in value.split(",")])
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of audio per simulated call")
+    parser.add_argument("--ramp", type=float, default=2.0, help="seconds over which calls at a level connect")
+    parser.add_argument("--budget-ms", type=float, default=150.0, help="p99 relay latency that counts as degraded")
+    parser.add_argument("--loop-lag-budget-ms", type=float, default=50.0)
+    parser.add_argument("--keep-going", action="store_true", help="run every level even after degradation")
+    parser.add_argument("--webhook", action="store_true", help="place each call through /incoming-call first")
+    parser.add_argument("--customgpt-latency", type=float, default=1.5)
+    parser.add_argument("--customgpt-first-token", type=float, default=0.5,
+                        help="seconds before a streamed answer (KB_STREAM_ENABLED) starts arriving")
+    parser.add_argument("--twilio-latency", type=float, default=0.1)
+    parser.add_argument("--greeting-seconds", type=float, default=2.0)
+    parser.add_argument("--answer-seconds", type=float, default=4.0)
+    parser.add_argument("--turn-every", type=float, default=6.0, help="seconds of caller audio between turns")
+    parser.add_argument("--tts-speed", type=float, default=2.0, help="how much faster than real time deltas arrive")
+    parser.add_argument("--repeat-queries", action="store_true", help="ask every call the same question")
+    parser.add_argument("--app-url", help="drive an already running app instead of starting one")
+    parser.add_argument("--app-log-level", default="WARNING")
+    parser.add_argument("--port", type=int, default=5055)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,77 @@
+"""Runs main.app under a single uvicorn worker with probes for the load test.
+
+Adds GET /loadtest/stats (event-loop lag percentiles, process CPU time, resident memory) and
+POST /loadtest/reset. Started by benchmarks/loadtest.py; point OPENAI_REALTIME_URL,
+CUSTOMGPT_BASE_URL and TWILIO_API_BASE_URL at the stand-ins in benchmarks/fakes.py.
+
+    python benchmarks/loadtest_app.py --port 5055
+"""
+import argparse
+import asyncio
+import logging
+import os
+import resource
+import sys
+import time
+
+import uvicorn
+
+import common
+
+# loadtest.py passes the real settings in the environment.
+common.setup(placeholder_env=False)
+
+import main  # noqa: E402
+
+LAG_INTERVAL = 0.01
+lag_samples = []
+
+
+async def sample_event_loop_lag():
+    while True:
+        scheduled = time.perf_counter()
+        await asyncio.sleep(LAG_INTERVAL)
+        lag_samples.append(time.perf_counter() - scheduled - LAG_INTERVAL)
+
+
+def resident_memory_bytes():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # macOS reports the peak in bytes, Linux in kilobytes; peak is the best we have here.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+@main.app.on_event("startup")
+async def start_lag_probe():
+    asyncio.create_task(sample_event_loop_lag())
+
+
+@main.app.get("/loadtest/stats")
+async def loadtest_stats():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return {
+        "loop_lag_p50": common.percentile(lag_samples, 0.5),
+        "loop_lag_p99": common.percentile(lag_samples, 0.99),
+        "loop_lag_max": max(lag_samples, default=0.0),
+        "cpu_seconds": usage.ru_utime + usage.ru_stime,
+        "rss_bytes": resident_memory_bytes(),
+    }
+
+
+@main.app.post("/loadtest/reset")
+async def loadtest_reset():
+    lag_samples.clear()
+    return {"status": "reset"}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--log-level", default=os.getenv("LOADTEST_APP_LOG_LEVEL", "INFO"))
+    args = parser.parse_args()
+    logging.getLogger().setLevel(args.log_level)
+    uvicorn.run(main.app, host=args.host, port=args.port, log_level="warning", ws_max_size=16 * 1024 * 1024)
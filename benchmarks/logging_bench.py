@@ -0,0 +1,138 @@
+"""Benchmark of the event-loop cost of logging one call.
+
+Replays the log calls a call makes (the session update, then per turn the realtime events in
+LOG_EVENT_TYPES, barge-in and the knowledge-base query and answer) and measures the CPU time
+spent in the calling thread, which in the app is the event loop. Compares the original eager
+f-string logging with the lazy, field-selected and truncated payloads, written inline or
+through the background queue, and with logging off. Output goes to os.devnull.
+
+    python benchmarks/logging_bench.py --calls 200 --turns 10
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+
+import common
+
+common.setup()
+
+import main  # noqa: E402
+
+SESSION_ID = "00000000-0000-0000-0000-000000000000"
+ANSWER = ("We are open from nine to five, Monday to Friday, and from ten to two on Saturdays. "
+          "Public holidays follow the Saturday hours. You can also reach support by email at any time.")
+QUERY = "Please use your knowledge base to answer: what are the opening hours on weekends and public holidays?"
+
+
+class CapturingSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, message):
+        self.sent.append(message)
+
+
+def session_update():
+    ws = CapturingSocket()
+    logging.disable(logging.CRITICAL)
+    asyncio.run(main.send_session_update(ws, "+15550000000", "Hello there"))
+    logging.disable(logging.NOTSET)
+    return json.loads(ws.sent[0])
+
+
+def turn_events(turn):
+    item = f"item_{turn:04d}"
+    response = f"resp_{turn:04d}"
+    return [
+        {"type": "input_audio_buffer.speech_started", "event_id": f"event_{turn}_1", "audio_start_ms": 1000 * turn, "item_id": item},
+        {"type": "input_audio_buffer.speech_stopped", "event_id": f"event_{turn}_2", "audio_end_ms": 1000 * turn + 900, "item_id": item},
+        {"type": "input_audio_buffer.committed", "event_id": f"event_{turn}_3", "previous_item_id": None, "item_id": item},
+        {"type": "conversation.item.input_audio_transcription.completed", "event_id": f"event_{turn}_4",
+         "item_id": item, "content_index": 0, "transcript": "What are your opening hours on the weekend?"},
+        {"type": "response.audio.done", "event_id": f"event_{turn}_5", "response_id": response, "item_id": item,
+         "output_index": 0, "content_index": 0},
+        {"type": "response.content.done", "event_id": f"event_{turn}_6", "response_id": response, "item_id": item,
+         "output_index": 0, "content_index": 0, "part": {"type": "audio", "transcript": ANSWER}},
+        {"type": "response.done", "event_id": f"event_{turn}_7", "response": {
+            "object": "realtime.response", "id": response, "status": "completed", "status_details": None,
+            "output": [{"id": item, "object": "realtime.item", "type": "message", "status": "completed",
+                        "role": "assistant", "content": [{"type": "audio", "transcript": ANSWER}]}],
+            "usage": {"total_tokens": 1834, "input_tokens": 1523, "output_tokens": 311,
+                      "input_token_details": {"cached_tokens": 1280, "text_tokens": 1190, "audio_tokens": 333,
+                                              "cached_tokens_details": {"text_tokens": 1152, "audio_tokens": 128}},
+                      "output_token_details": {"text_tokens": 62, "audio_tokens": 249}},
+        }},
+    ]
+
+
+def call_before(logger, update, turns):
+    logger.info('Sending session update: %s', json.dumps(update))
+    for events in turns:
+        for event in events:
+            if event['type'] in main.LOG_EVENT_TYPES:
+                logger.info(f"Received event: {event['type']}::{event}")
+            if event['type'] == "input_audio_buffer.speech_started":
+                logger.info(f"Input Audio Detected::{event}")
+        logger.info(f"CustomGPT query sent:: {QUERY}")
+        logger.info(f"CustomGPT response: {ANSWER}")
+
+
+def call_after(logger, update, turns):
+    logger.info('Sending session update: %s', main.LogPayload(update['session'], ('voice', 'turn_detection', 'modalities', 'instructions')))
+    for events in turns:
+        for event in events:
+            if event['type'] in main.LOG_EVENT_TYPES:
+                main.log_realtime_event(event, SESSION_ID)
+            if event['type'] == "input_audio_buffer.speech_started":
+                logger.info("Input Audio Detected::%s", main.LogPayload(event))
+        logger.info("CustomGPT query sent:: %s", main.LogPayload(QUERY))
+        logger.info("CustomGPT response: %s", main.LogPayload(ANSWER))
+
+
+def measure(label, replay, calls, update, turns, level=logging.INFO, log_format='text', queued=False,
+            sample_rate=1.0, caller_info=False):
+    # main.py turns off per-record caller, thread and multiprocessing lookups; the original did not.
+    logging._srcfile = os.path.normcase(logging.addLevelName.__code__.co_filename) if caller_info else None
+    logging.logThreads = logging.logMultiprocessing = caller_info
+    main.LOG_EVENT_SAMPLE_RATES = {event_type: sample_rate for event_type in main.LOG_EVENT_TYPES}
+    root = logging.getLogger()
+    devnull = open(os.devnull, "w")
+    root.handlers = [logging.StreamHandler(devnull)]
+    root.setLevel(level)
+    main.LOG_FORMAT = log_format
+    main.LOG_QUEUE_ENABLED = queued
+    main.start_log_queue()
+    cpu_start = time.thread_time()
+    wall_start = time.perf_counter()
+    for _ in range(calls):
+        replay(main.logger, update, turns)
+    cpu = time.thread_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+    main.stop_log_queue()
+    devnull.close()
+    print(f"{label:<40}{cpu / calls * 1e3:>14.3f}{wall / calls * 1e3:>14.3f}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=10)
+    args = parser.parse_args()
+
+    update = session_update()
+    turns = [turn_events(turn) for turn in range(args.turns)]
+    print(f"{args.calls} calls of {args.turns} turns, payloads cut to {main.LOG_PAYLOAD_CHARS} chars")
+    print(f"{'logging':<40}{'loop ms/call':>14}{'wall ms/call':>14}")
+    measure("off (WARNING level)", call_after, args.calls, update, turns, level=logging.WARNING)
+    measure("before: eager f-strings", call_before, args.calls, update, turns, caller_info=True)
+    measure("after: lazy, inline", call_after, args.calls, update, turns)
+    measure("after: lazy, queued", call_after, args.calls, update, turns, queued=True)
+    measure("after: lazy, queued, json", call_after, args.calls, update, turns, log_format='json', queued=True)
+    measure("after: lazy, queued, events sampled 10%", call_after, args.calls, update, turns, queued=True, sample_rate=0.1)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,141 @@
+"""Micro-benchmark of the Twilio <-> OpenAI Realtime audio relay.
+
+Compares the original per-frame handling (json.loads/json.dumps of every media event and a
+base64 decode/re-encode of every audio delta) with the relay fast path in main.py, and the
+inbound fast path with InboundAudio's batching of caller frames into larger appends.
+
+    python benchmarks/relay_bench.py --frames 200000
+"""
+import argparse
+import asyncio
+import base64
+import json
+import time
+
+import common
+
+common.setup()
+
+import main  # noqa: E402
+
+# Twilio sends 20 ms of 8 kHz g711_ulaw per media event, 50 events per second per call.
+FRAME_BYTES = 160
+FRAMES_PER_SECOND = 50
+STREAM_SID = "MZ" + "0" * 32
+
+
+def twilio_frame(sequence):
+    payload = base64.b64encode(bytes((sequence + i) % 256 for i in range(FRAME_BYTES))).decode('utf-8')
+    return json.dumps({
+        "event": "media",
+        "sequenceNumber": str(sequence),
+        "media": {"track": "inbound", "chunk": str(sequence), "timestamp": str(sequence * 20), "payload": payload},
+        "streamSid": STREAM_SID,
+    }, separators=(',', ':'))
+
+
+def realtime_delta(sequence):
+    payload = base64.b64encode(bytes((sequence + i) % 256 for i in range(FRAME_BYTES))).decode('utf-8')
+    return json.dumps({
+        "type": "response.audio.delta",
+        "event_id": f"event_{sequence}",
+        "response_id": "resp_0",
+        "item_id": "item_0",
+        "output_index": 0,
+        "content_index": 0,
+        "delta": payload,
+    }, separators=(',', ':'))
+
+
+def inbound_before(messages):
+    for message in messages:
+        data = json.loads(message)
+        if data['event'] == 'media':
+            json.dumps({"type": "input_audio_buffer.append", "audio": data['media']['payload']})
+
+
+def inbound_after(messages):
+    for message in messages:
+        payload = main.twilio_media_payload(message)
+        if payload is not None:
+            main.audio_append_message(payload)
+
+
+class NullRealtime:
+    open = True
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send(self, message):
+        self.sent += 1
+
+
+def inbound_batched(messages):
+    realtime = NullRealtime()
+
+    async def relay():
+        inbound = main.InboundAudio(realtime, main.CallMetrics())
+        for message in messages:
+            payload = main.twilio_media_payload(message)
+            if payload is not None:
+                await inbound.put(payload)
+        await inbound.flush()
+
+    asyncio.run(relay())
+    return realtime.sent
+
+
+def outbound_before(messages):
+    for message in messages:
+        response = json.loads(message)
+        if response['type'] == 'response.audio.delta' and response.get('delta'):
+            audio_payload = base64.b64encode(base64.b64decode(response['delta'])).decode('utf-8')
+            json.dumps({"event": "media", "streamSid": STREAM_SID, "media": {"payload": audio_payload}})
+
+
+def outbound_after(messages):
+    media_prefix = main.twilio_media_prefix(STREAM_SID)
+    for message in messages:
+        delta = main.realtime_audio_delta(message)
+        if delta is not None:
+            media_prefix + delta + main.MEDIA_SUFFIX
+
+
+def measure(relay, messages):
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    relay(messages)
+    wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+    return len(messages) / wall, cpu / len(messages)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frames", type=int, default=100000)
+    parser.add_argument("--batch-ms", type=int, default=60)
+    args = parser.parse_args()
+    main.INBOUND_BATCH_MS = args.batch_ms
+
+    inbound = [twilio_frame(i) for i in range(args.frames)]
+    outbound = [realtime_delta(i) for i in range(args.frames)]
+    codec = "orjson" if main.json_loads is not json.loads else "json"
+    print(f"{args.frames} frames per direction, codec: {codec}")
+    print(f"{'path':<28}{'frames/sec':>14}{'us/frame':>12}{'CPU %/call':>12}")
+    for label, relay, messages in (
+        ("inbound before", inbound_before, inbound),
+        ("inbound after", inbound_after, inbound),
+        (f"inbound batched {args.batch_ms} ms", inbound_batched, inbound),
+        ("outbound before", outbound_before, outbound),
+        ("outbound after", outbound_after, outbound),
+    ):
+        rate, cpu_per_frame = measure(relay, messages)
+        # One call relays FRAMES_PER_SECOND frames in this direction every second.
+        print(f"{label:<28}{rate:>14,.0f}{cpu_per_frame * 1e6:>12.2f}{cpu_per_frame * FRAMES_PER_SECOND * 100:>12.4f}")
+    # Each append is one websocket frame and write on the socket to the realtime API; that
+    # per-message cost is outside this loop and is what the load test measures.
+    appends = FRAMES_PER_SECOND * 20 // max(20, args.batch_ms // 20 * 20)
+    print(f"appends to the realtime API per call-second: {FRAMES_PER_SECOND} unbatched, {appends} at {args.batch_ms} ms")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,295 @@
+"""Replays captured calls through the app against local stand-ins and checks latency and ordering.
+
+Calls captured with CALL_CAPTURE_DIR (see the README) are played back one after another. The
+Twilio side of each capture goes to /media-stream/... on the captured schedule, and a stand-in
+realtime API sends the captured realtime events on the same clock. As the real API would, the
+stand-in holds the response that follows a function call until the app has answered it, so that
+gap is set by the app's own knowledge-base lookup against the fake CustomGPT from
+benchmarks/fakes.py. --speed compresses the schedule.
+
+Audio keeps its captured length (and content, for captures with CALL_CAPTURE_AUDIO=keep) but
+carries a stamp (see fakes.stamp_audio), so relay latency is measured on the far side of the app.
+Each call is checked for:
+- p99 lateness of assistant audio against real-time playout, and p99 caller audio relay
+  latency, within --budget-ms
+- p99 speech_started to Twilio clear within --barge-in-budget-ms
+- p99 function call to the app's function_call_output within --function-budget-ms
+- ordering: caller and assistant audio arrive in order, each knowledge-base function call is
+  answered exactly once and before the response that follows it, and every speech_started after
+  the stream started is followed by a clear
+
+The exit status is non-zero if any call fails a check. The app is started as in loadtest.py and
+needs a Redis; the greeting and answer caches are off unless set, so replays do not warm them.
+
+    REDIS_URL=redis://127.0.0.1:6379 REDIS_SSL=false python benchmarks/replay.py captures/*.jsonl.gz --speed 2
+"""
+import argparse
+import asyncio
+import base64
+import collections
+import gzip
+import json
+import os
+import sys
+import time
+import urllib.parse
+import uuid
+
+import websockets
+
+import fakes
+from common import percentile
+from loadtest import start_app, wait_for_app
+
+KNOWLEDGE_BASE_FUNCTION = "get_additional_context"
+
+
+def load_capture(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as capture_file:
+        header = json.loads(capture_file.readline())
+        records = [json.loads(line) for line in capture_file if line.strip()]
+    twilio = [(record["t"], record["msg"]) for record in records if record["src"] == "twilio"]
+    realtime = [(record["t"], record["msg"]) for record in records if record["src"] == "openai"]
+    return header, twilio, realtime
+
+
+def stamped_audio(payload, stamp_time):
+    """The captured audio, or silence of its length if only its digest was kept, stamped with stamp_time."""
+    raw = base64.b64decode(payload) if isinstance(payload, str) else fakes.ULAW_SILENCE * payload["bytes"]
+    if len(raw) >= fakes.STAMP.size:
+        raw = fakes.STAMP.pack(fakes.STAMP_MAGIC, 0, stamp_time) + raw[fakes.STAMP.size:]
+    return base64.b64encode(raw).decode('utf-8'), len(raw)
+
+
+class CallReplay:
+    def __init__(self, path, speed, function_timeout):
+        self.name = os.path.basename(path)
+        self.header, self.twilio, self.realtime = load_capture(path)
+        self.speed = speed
+        self.function_timeout = function_timeout
+        self.started = None
+        # Seconds the realtime schedule has slipped waiting for the app's function answers.
+        self.shift = 0.0
+        self.released_at = None
+        self.stream_started = False
+        self.realtime_done = asyncio.Event()
+        self.answers = {}
+        self.outputs = collections.Counter()
+        self.pending_output = None
+        self.speech_started = collections.deque()
+        self.response_due = {}
+        self.outbound, self.inbound, self.barge_in, self.function = [], [], [], []
+        self.last_inbound = self.last_outbound = 0.0
+        self.failures = []
+
+    def fail(self, message):
+        if message not in self.failures:
+            self.failures.append(message)
+
+    async def sleep_until(self, elapsed, shifted):
+        due = self.started + elapsed / self.speed
+        if shifted:
+            if self.released_at is not None:
+                # Events after an answered function call keep their captured spacing from the answer.
+                self.shift = max(self.shift, self.released_at - due)
+                self.released_at = None
+            due += self.shift
+        await asyncio.sleep(max(0.0, due - time.monotonic()))
+
+    # Stand-in realtime API.
+
+    async def serve_realtime(self, ws):
+        reader = asyncio.create_task(self.read_app_events(ws))
+        waiting_call = None
+        try:
+            await ws.send(fakes.compact({"type": "session.created"}))
+            for elapsed, event in self.realtime:
+                kind = event.get("type")
+                if kind in ("session.created", "session.updated"):
+                    continue
+                if kind == "response.created" and waiting_call is not None:
+                    await self.wait_for_answer(*waiting_call)
+                    waiting_call = None
+                await self.sleep_until(elapsed, shifted=True)
+                if kind == "response.audio.delta":
+                    event = dict(event, delta=self.outbound_audio(event))
+                elif kind == "input_audio_buffer.speech_started" and self.stream_started:
+                    self.speech_started.append(time.monotonic())
+                await ws.send(fakes.compact(event))
+                if kind == "response.function_call_arguments.done" and event.get("name") == KNOWLEDGE_BASE_FUNCTION:
+                    waiting_call = (event["call_id"], time.monotonic())
+            self.realtime_done.set()
+            await reader
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            self.realtime_done.set()
+            reader.cancel()
+
+    def outbound_audio(self, event):
+        # Due at the moment it would play if the response were played in real time from its first delta.
+        response_id = event.get("response_id")
+        due = self.response_due.setdefault(response_id, time.monotonic())
+        payload, size = stamped_audio(event["delta"], due)
+        self.response_due[response_id] = due + size / 8000
+        return payload
+
+    async def wait_for_answer(self, call_id, sent_at):
+        answered = self.answers.setdefault(call_id, asyncio.Event())
+        try:
+            await asyncio.wait_for(answered.wait(), self.function_timeout)
+            self.function.append(time.monotonic() - sent_at)
+        except asyncio.TimeoutError:
+            self.fail(f"function call {call_id} not answered within {self.function_timeout:.0f} s")
+        self.released_at = time.monotonic()
+
+    async def read_app_events(self, ws):
+        async for message in ws:
+            event = json.loads(message)
+            kind = event.get("type")
+            if kind == "session.update":
+                await ws.send(fakes.compact({"type": "session.updated"}))
+            elif kind == "input_audio_buffer.append":
+                stamp = fakes.read_stamp(event["audio"])
+                if stamp is not None:
+                    self.inbound.append(time.monotonic() - stamp[1])
+                    if stamp[1] < self.last_inbound:
+                        self.fail("caller audio reached the realtime API out of order")
+                    self.last_inbound = stamp[1]
+            elif kind == "conversation.item.create" and event["item"].get("type") == "function_call_output":
+                call_id = event["item"]["call_id"]
+                self.outputs[call_id] += 1
+                if self.outputs[call_id] > 1:
+                    self.fail(f"function call {call_id} answered more than once")
+                self.pending_output = call_id
+            elif kind == "response.create" and self.pending_output is not None:
+                self.answers.setdefault(self.pending_output, asyncio.Event()).set()
+                self.pending_output = None
+
+    # Stand-in Twilio media stream.
+
+    async def run(self, app_url):
+        introduction = urllib.parse.quote_plus(self.header.get("introduction") or "Hello")
+        path = (f"/media-stream/project/{self.header.get('project_id', 1)}/session/{uuid.uuid4()}"
+                f"/%2B15550000000/{introduction}")
+        self.started = time.monotonic()
+        async with websockets.connect(app_url.replace("http", "ws", 1) + path, max_size=None) as ws:
+            receiver = asyncio.create_task(self.receive_from_app(ws))
+            for elapsed, event in self.twilio:
+                await self.sleep_until(elapsed, shifted=False)
+                if event.get("event") == "media":
+                    payload, _ = stamped_audio(event["media"]["payload"], time.monotonic())
+                    event = dict(event, media=dict(event["media"], payload=payload))
+                elif event.get("event") == "start":
+                    parameters = dict(event["start"].get("customParameters", {}), api_key="replay")
+                    event = dict(event, start=dict(event["start"], customParameters=parameters))
+                    self.stream_started = True
+                await ws.send(fakes.compact(event))
+            remaining = max((elapsed for elapsed, _ in self.realtime), default=0) / self.speed
+            try:
+                await asyncio.wait_for(self.realtime_done.wait(), remaining + self.shift + self.function_timeout)
+            except asyncio.TimeoutError:
+                self.fail("realtime events did not play out")
+            # Let the last audio and clears arrive.
+            await asyncio.sleep(1.0)
+            receiver.cancel()
+        if self.speech_started:
+            self.fail(f"{len(self.speech_started)} speech_started events not followed by a clear")
+
+    async def receive_from_app(self, ws):
+        async for message in ws:
+            received_at = time.monotonic()
+            event = json.loads(message)
+            if event["event"] == "clear" and self.speech_started:
+                self.barge_in.append(received_at - self.speech_started.popleft())
+            elif event["event"] == "media":
+                stamp = fakes.read_stamp(event["media"]["payload"])
+                if stamp is None:
+                    # Hold audio is not stamped.
+                    continue
+                self.outbound.append(max(0.0, received_at - stamp[1]))
+                if stamp[1] < self.last_outbound:
+                    self.fail("assistant audio reached Twilio out of order")
+                self.last_outbound = stamp[1]
+
+    def check(self, args):
+        budgets = [
+            ("assistant audio p99", self.outbound, args.budget_ms),
+            ("caller audio p99", self.inbound, args.budget_ms),
+            ("barge-in p99", self.barge_in, args.barge_in_budget_ms),
+            ("function answer p99", self.function, args.function_budget_ms),
+        ]
+        for label, values, budget in budgets:
+            if percentile(values, 0.99) * 1000 > budget:
+                self.fail(f"{label} {percentile(values, 0.99) * 1000:.0f} ms over the {budget:.0f} ms budget")
+        return not self.failures
+
+
+def print_result(replay, passed):
+    duration = max((elapsed for elapsed, _ in replay.twilio + replay.realtime), default=0)
+    print(f"{replay.name[:40]:<40}{duration:>7.1f}"
+          f"{percentile(replay.outbound, 0.5) * 1000:>8.1f}{percentile(replay.outbound, 0.99) * 1000:>8.1f}"
+          f"{percentile(replay.inbound, 0.5) * 1000:>8.1f}{percentile(replay.inbound, 0.99) * 1000:>8.1f}"
+          f"{percentile(replay.barge_in, 0.99) * 1000:>9.1f}{percentile(replay.function, 0.99) * 1000:>9.0f}"
+          f"  {'ok' if passed else 'FAIL'}")
+    for failure in replay.failures:
+        print(f"  {failure}")
+
+
+async def run(args):
+    replays = {"current": None}
+
+    async def handle_realtime(ws):
+        await replays["current"].serve_realtime(ws)
+
+    realtime_server = await websockets.serve(handle_realtime, "127.0.0.1", 0, max_size=None)
+    rest = fakes.FakeRestServer(customgpt_latency=args.customgpt_latency, customgpt_first_token=args.customgpt_first_token)
+    realtime_port = realtime_server.sockets[0].getsockname()[1]
+    rest_port = await rest.start()
+    # Replays must not warm the caches, or capture themselves.
+    os.environ.setdefault("GREETING_CACHE_ENABLED", "false")
+    os.environ.setdefault("KB_CACHE_ENABLED", "false")
+    os.environ.pop("CALL_CAPTURE_DIR", None)
+    args.webhook = False
+    app = start_app(args, realtime_port, rest_port)
+    app_url = f"http://127.0.0.1:{args.port}"
+    failed = 0
+    try:
+        await wait_for_app(app_url)
+        print(f"{'capture':<40}{'secs':>7}{'out p50':>8}{'out p99':>8}{'in p50':>8}{'in p99':>8}"
+              f"{'barge99':>9}{'func99':>9}")
+        for path in args.captures:
+            replay = CallReplay(path, args.speed, args.function_timeout)
+            replays["current"] = replay
+            await replay.run(app_url)
+            passed = replay.check(args)
+            failed += not passed
+            print_result(replay, passed)
+    finally:
+        app.terminate()
+        app.wait()
+        realtime_server.close()
+        await realtime_server.wait_closed()
+        await rest.stop()
+    print(f"{len(args.captures) - failed} of {len(args.captures)} calls within budget")
+    return failed
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("captures", nargs="+", help="capture files written under CALL_CAPTURE_DIR")
+    parser.add_argument("--speed", type=float, default=1.0, help="how much faster than captured to replay")
+    parser.add_argument("--budget-ms", type=float, default=150.0, help="p99 relay latency budget, both directions")
+    parser.add_argument("--barge-in-budget-ms", type=float, default=100.0)
+    parser.add_argument("--function-budget-ms", type=float, default=3000.0)
+    parser.add_argument("--function-timeout", type=float, default=20.0,
+                        help="seconds to wait for the app to answer a function call")
+    parser.add_argument("--customgpt-latency", type=float, default=1.5)
+    parser.add_argument("--customgpt-first-token", type=float, default=0.5)
+    parser.add_argument("--app-log-level", default="WARNING")
+    parser.add_argument("--port", type=int, default=5056)
+    sys.exit(1 if asyncio.run(run(parser.parse_args())) else 0)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,123 @@
+"""Benchmark of the local voice activity detector on the caller's audio.
+
+Synthesizes a call of talk spurts and pauses over line noise as 20 ms g711_ulaw frames, runs
+it through main.LocalVad with silence suppression on, and reports how many
+input_audio_buffer.append messages reach the realtime API with INBOUND_BATCH_MS=20, how long
+after each spurt starts the local onset fires, and the CPU cost per frame. In production the
+local_vad_lead_seconds histogram on /metrics records how far that onset lands ahead of the
+realtime API's speech_started.
+
+    python benchmarks/vad_bench.py --seconds 600
+"""
+import argparse
+import base64
+import binascii
+import time
+
+import numpy as np
+
+import common
+
+common.setup()
+
+import main  # noqa: E402
+
+SAMPLE_RATE = 8000
+FRAME_SAMPLES = main.ULAW_FRAME_BYTES
+FRAMES_PER_SECOND = SAMPLE_RATE // FRAME_SAMPLES
+
+
+def dbfs_to_amplitude(level):
+    return 32768 * 10 ** (level / 20)
+
+
+def synthesize_call(seconds, speech_dbfs, noise_dbfs, seed):
+    """g711_ulaw frames of alternating pauses and talk spurts, and the frame index of each spurt."""
+    rng = np.random.default_rng(seed)
+    total = int(seconds * SAMPLE_RATE)
+    samples = rng.normal(0, dbfs_to_amplitude(noise_dbfs), total)
+    onsets = []
+    position = int(rng.uniform(1, 3) * SAMPLE_RATE)
+    while position < total:
+        length = min(int(rng.uniform(0.8, 4) * SAMPLE_RATE), total - position)
+        t = np.arange(length) / SAMPLE_RATE
+        # Voiced-speech stand-in: a few harmonics of a 120 Hz pitch, modulated at syllable rate.
+        voice = sum(np.sin(2 * np.pi * 120 * harmonic * t) / harmonic for harmonic in (1, 2, 3, 5))
+        envelope = 0.55 + 0.45 * np.sin(2 * np.pi * 4 * t - np.pi / 2)
+        spurt = voice * envelope
+        spurt *= dbfs_to_amplitude(speech_dbfs) / np.sqrt(np.mean(spurt ** 2))
+        samples[position:position + length] += spurt
+        onsets.append(position // FRAME_SAMPLES)
+        position += length + int(rng.uniform(1, 5) * SAMPLE_RATE)
+    pcm = np.clip(samples, -32768, 32767).astype(np.int16)
+    ulaw = main.linear_to_ulaw(pcm[:len(pcm) // FRAME_SAMPLES * FRAME_SAMPLES])
+    frames = [
+        base64.b64encode(ulaw[offset:offset + FRAME_SAMPLES]).decode('utf-8')
+        for offset in range(0, len(ulaw), FRAME_SAMPLES)
+    ]
+    return frames, onsets
+
+
+def run(frames):
+    vad = main.LocalVad()
+    messages, frames_forwarded, detections = 0, 0, []
+    cpu_start = time.process_time()
+    for index, payload in enumerate(frames):
+        raw, speech_started = vad.process(binascii.a2b_base64(payload))
+        if speech_started:
+            detections.append(index)
+        if raw is not None:
+            messages += 1
+            frames_forwarded += vad.frames_forwarded
+    return messages, frames_forwarded, detections, time.process_time() - cpu_start
+
+
+def onset_delays_ms(onsets, detections):
+    delays, missed = [], 0
+    pending = iter(detections)
+    detection = next(pending, None)
+    for onset in onsets:
+        while detection is not None and detection < onset:
+            detection = next(pending, None)
+        if detection is None or detection - onset > FRAMES_PER_SECOND:
+            missed += 1
+            continue
+        delays.append((detection - onset + 1) * 1000 / FRAMES_PER_SECOND)
+    return delays, missed
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=300)
+    parser.add_argument("--speech-dbfs", type=float, default=-24)
+    parser.add_argument("--noise-dbfs", type=float, default=-55)
+    parser.add_argument("--threshold-dbfs", type=float, default=main.LOCAL_VAD_THRESHOLD_DBFS)
+    parser.add_argument("--onset-frames", type=int, default=main.LOCAL_VAD_ONSET_FRAMES)
+    parser.add_argument("--hangover-ms", type=int, default=main.LOCAL_VAD_HANGOVER_MS)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    main.LOCAL_VAD_THRESHOLD_DBFS = args.threshold_dbfs
+    main.LOCAL_VAD_ONSET_FRAMES = args.onset_frames
+    main.LOCAL_VAD_HANGOVER_MS = args.hangover_ms
+    main.LOCAL_VAD_SUPPRESS_SILENCE = True
+
+    frames, onsets = synthesize_call(args.seconds, args.speech_dbfs, args.noise_dbfs, args.seed)
+    messages, frames_forwarded, detections, cpu = run(frames)
+    delays, missed = onset_delays_ms(onsets, detections)
+
+    print(f"{len(frames)} frames ({args.seconds:.0f} s), {len(onsets)} talk spurts, "
+          f"threshold {args.threshold_dbfs:.0f} dBFS, onset {args.onset_frames} frames, hangover {args.hangover_ms} ms")
+    print(f"{'append messages/sec':<32}{len(frames) / args.seconds:>10.1f} -> {messages / args.seconds:.1f} "
+          f"({100 * (1 - messages / len(frames)):.1f}% fewer)")
+    print(f"{'caller audio forwarded':<32}{100 * frames_forwarded / len(frames):>9.1f}%")
+    if delays:
+        print(f"{'local onset after spurt start':<32}{np.percentile(delays, 50):>8.0f} ms p50"
+              f"{np.percentile(delays, 99):>8.0f} ms p99, {missed} missed, "
+              f"{max(0, len(detections) - len(delays))} false")
+    print(f"{'VAD CPU':<32}{cpu / len(frames) * 1e6:>8.2f} us/frame"
+          f"{cpu / len(frames) * FRAMES_PER_SECOND * 100:>10.4f} CPU %/call")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,22 @@
+# Loaded automatically by gunicorn from the working directory (see Procfile and start.sh).
+import os
+import shutil
+import tempfile
+
+# prometheus_client picks its metric storage when it is first imported, so the multiprocess
+# directory must be in the environment before any worker imports main.py.
+prometheus_dir = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "prometheus-multiproc")
+)
+shutil.rmtree(prometheus_dir, ignore_errors=True)
+os.makedirs(prometheus_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
+
+# On SIGTERM each worker drains its live calls for up to CALL_DRAIN_TIMEOUT (see main.py); let it
+# finish that and shut down before gunicorn kills it.
+graceful_timeout = float(os.getenv("CALL_DRAIN_TIMEOUT", 120)) + 15
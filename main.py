@@ -2,31 +2,120 @@ import os
 import json
 import base64
 import asyncio
+import random
+import re
+import math
+import array
+import hashlib
+import struct
+import gzip
+import signal
+import heapq
+import itertools
+import binascii
+from collections import OrderedDict, deque
+import aiohttp
+from aiohttp_retry import ExponentialRetry, RetryClient
+import numpy as np
 import websockets
 import urllib.parse
+from contextlib import AsyncExitStack, asynccontextmanager
 from fastapi import FastAPI, WebSocket, Request, WebSocketDisconnect, status, BackgroundTasks
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, Response
 from fastapi.staticfiles import StaticFiles
 from typing import Optional
 from twilio.rest import Client
+from twilio.http.async_http_client import AsyncTwilioHttpClient
 from twilio.twiml.voice_response import VoiceResponse, Connect, Redirect, Dial, Stream
 from dotenv import load_dotenv
-from customgpt_client import CustomGPT
 import uuid
 import logging
+import logging.handlers
+import queue
 import time
-import redis
+import redis.asyncio as redis
+from enum import Enum
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+
+try:
+    import orjson
+
+    json_loads = orjson.loads
+
+    def json_dumps(obj):
+        return orjson.dumps(obj).decode('utf-8')
+except ImportError:
+    json_loads = json.loads
+    json_dumps = json.dumps
 
 load_dotenv()
 
 redis_url = urllib.parse.urlparse(os.environ.get("REDIS_URL"))
-redis_client = redis.Redis(host=redis_url.hostname, port=redis_url.port, password=redis_url.password, ssl=True, ssl_cert_reqs=None)
+REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', 50))
+# Pooled, non-blocking client; connections are opened lazily on the worker's event loop.
+redis_client = redis.Redis(
+    host=redis_url.hostname,
+    port=redis_url.port,
+    password=redis_url.password,
+    ssl=os.getenv('REDIS_SSL', 'true').lower() == 'true',
+    ssl_cert_reqs=None,
+    max_connections=REDIS_MAX_CONNECTIONS,
+    health_check_interval=30,
+)
 current_dir = os.path.dirname(__file__)
-mp3_file_path = os.path.join(current_dir, "static", "typing.wav")
+# Looped to the caller while a knowledge-base lookup is outstanding; empty for silence.
+HOLD_AUDIO_FILE = os.getenv('HOLD_AUDIO_FILE', os.path.join(current_dir, "static", "typing.wav"))
+# Per-project clips as "project_id=path,...".
+HOLD_AUDIO_PROJECT_FILES = {
+    int(project): path
+    for project, path in (item.split('=', 1) for item in os.getenv('HOLD_AUDIO_PROJECT_FILES', '').split(',') if '=' in item)
+}
 account_sid = os.environ["TWILIO_ACCOUNT_SID"]
 auth_token = os.environ["TWILIO_AUTH_TOKEN"]
-client = Client(account_sid, auth_token)
+# Lets local stand-ins (see benchmarks/) take the place of the Twilio REST API.
+TWILIO_API_BASE_URL = os.getenv('TWILIO_API_BASE_URL')
+TWILIO_TIMEOUT = float(os.getenv('TWILIO_TIMEOUT', 10))
+# Total attempts per Twilio REST request, with exponential backoff. Reads are retried on connection
+# errors, timeouts, 429 and 5xx; creates (new SMS, recordings) only when the connection could not be
+# made or Twilio answered 429, so a request Twilio may have acted on is never sent twice.
+TWILIO_MAX_ATTEMPTS = int(os.getenv('TWILIO_MAX_ATTEMPTS', 3))
+# Recording starts this long after the call is answered, once the media stream is up.
+RECORDING_DELAY = float(os.getenv('RECORDING_DELAY', 2))
 CUSTOMGPT_API_KEY = os.getenv('CUSTOMGPT_API_KEY')
+CUSTOMGPT_BASE_URL = os.getenv('CUSTOMGPT_BASE_URL', 'https://app.customgpt.ai')
+CUSTOMGPT_TIMEOUT = float(os.getenv('CUSTOMGPT_TIMEOUT', 15))
+CUSTOMGPT_MAX_RETRIES = int(os.getenv('CUSTOMGPT_MAX_RETRIES', 2))
+CUSTOMGPT_RETRY_BACKOFF = float(os.getenv('CUSTOMGPT_RETRY_BACKOFF', 0.5))
+CUSTOMGPT_POOL_SIZE = int(os.getenv('CUSTOMGPT_POOL_SIZE', 100))
+# How long a media stream that lands on another worker than its webhook waits for the CustomGPT
+# session that worker is creating, before every worker agrees on a fallback.
+CUSTOMGPT_SESSION_WAIT = float(os.getenv('CUSTOMGPT_SESSION_WAIT', 10))
+# SMS callers keep their CustomGPT conversation until they have been quiet this long.
+SMS_SESSION_TTL = int(os.getenv('SMS_SESSION_TTL', 24 * 3600))
+KB_FALLBACK_ANSWER = "Sorry, I didn't get your query."
+KB_CACHE_ENABLED = os.getenv('KB_CACHE_ENABLED', 'true').lower() == 'true'
+KB_CACHE_TTL = int(os.getenv('KB_CACHE_TTL', 3600))
+# Per-project overrides, e.g. "1234=600,5678=86400"
+KB_CACHE_PROJECT_TTLS = {
+    int(project): int(ttl)
+    for project, ttl in (item.split('=') for item in os.getenv('KB_CACHE_PROJECT_TTLS', '').split(',') if '=' in item)
+}
+KB_CACHE_MAX_ENTRIES = int(os.getenv('KB_CACHE_MAX_ENTRIES', 500))
+KB_CACHE_LOCAL_SIZE = int(os.getenv('KB_CACHE_LOCAL_SIZE', 256))
+KB_CACHE_LOCAL_TTL = int(os.getenv('KB_CACHE_LOCAL_TTL', 60))
+# Cosine similarity needed for a near-duplicate query to hit; 0 disables embedding lookups.
+KB_CACHE_SIMILARITY = float(os.getenv('KB_CACHE_SIMILARITY', 0))
+KB_CACHE_EMBEDDING_MODEL = os.getenv('KB_CACHE_EMBEDDING_MODEL', 'text-embedding-3-small')
+KB_CACHE_EMBEDDING_DIMENSIONS = int(os.getenv('KB_CACHE_EMBEDDING_DIMENSIONS', 256))
+# Opt-in: transcribe caller audio and start the knowledge-base lookup from the raw transcript.
+KB_PREFETCH_ENABLED = os.getenv('KB_PREFETCH_ENABLED', 'false').lower() == 'true'
+# Share of transcript words that must appear in the function call query for the prefetch to be reused.
+KB_PREFETCH_MIN_OVERLAP = float(os.getenv('KB_PREFETCH_MIN_OVERLAP', 0.8))
+# Opt-in: stream voice answers from CustomGPT and stop reading once there is enough to speak.
+KB_STREAM_ENABLED = os.getenv('KB_STREAM_ENABLED', 'false').lower() == 'true'
+KB_STREAM_MAX_SENTENCES = int(os.getenv('KB_STREAM_MAX_SENTENCES', 3))
+KB_STREAM_MAX_CHARS = int(os.getenv('KB_STREAM_MAX_CHARS', 500))
+INPUT_TRANSCRIPTION_MODEL = os.getenv('INPUT_TRANSCRIPTION_MODEL', 'whisper-1')
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 PORT = int(os.getenv('PORT', 5050))
 DEFAULT_INTRO = 'Hello! How can i assist you today'
@@ -91,28 +180,301 @@ SYSTEM_MESSAGE = """
 
 
 VOICE = 'alloy'
-LOG_EVENT_TYPES = [
+REALTIME_URL = os.getenv('OPENAI_REALTIME_URL', 'wss://api.openai.com/v1/realtime?model=gpt-4o-realtime-preview-2024-12-17')
+GREETING_CACHE_ENABLED = os.getenv('GREETING_CACHE_ENABLED', 'true').lower() == 'true'
+GREETING_CACHE_TTL = int(os.getenv('GREETING_CACHE_TTL', 7 * 24 * 3600))
+# Seconds a pre-warmed realtime session waits for its media stream before it is closed.
+REALTIME_PREWARM_TIMEOUT = float(os.getenv('REALTIME_PREWARM_TIMEOUT', 30))
+LOG_EVENT_TYPES = {
     'response.content.done', 'response.done',
     'input_audio_buffer.committed', 'input_audio_buffer.speech_stopped',
     'input_audio_buffer.speech_started', 'session.created', 'response.audio.done',
     'conversation.item.input_audio_transcription.completed'
-]
+}
+# "text" keeps the plain log lines; "json" writes one JSON object per record with its fields.
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()
+# Hand records to a background thread for formatting and writing, off the event loop.
+LOG_QUEUE_ENABLED = os.getenv('LOG_QUEUE_ENABLED', 'true').lower() == 'true'
+# Logged event payloads keep only these top-level fields and are cut to LOG_PAYLOAD_CHARS.
+LOG_EVENT_FIELDS = tuple(field for field in os.getenv(
+    'LOG_EVENT_FIELDS', 'type,event_id,item_id,call_id,name,transcript,response,error,audio_start_ms,audio_end_ms'
+).split(',') if field)
+LOG_PAYLOAD_CHARS = int(os.getenv('LOG_PAYLOAD_CHARS', 300))
+# Fraction of each realtime event type that is logged, as "response.done=0.1,...".
+LOG_EVENT_SAMPLE_RATES = {
+    event_type: float(rate)
+    for event_type, _, rate in (pair.partition('=') for pair in os.getenv('LOG_EVENT_SAMPLE_RATES', '').split(',') if pair)
+}
 
 PERSONAL_PHONE_NUMBER = os.getenv("PERSONAL_PHONE_NUMBER")
+CALL_STATE_TTL = int(os.getenv('CALL_STATE_TTL', 3600))
+# A call with no realtime events for this long is ended by the worker's SessionScheduler.
+CALL_INACTIVITY_TIMEOUT = float(os.getenv('CALL_INACTIVITY_TIMEOUT', 300))
+# Concurrent calls across every worker and node sharing the Redis, and per worker; 0 is unlimited.
+MAX_CALLS = int(os.getenv('MAX_CALLS', 0))
+MAX_CALLS_PER_WORKER = int(os.getenv('MAX_CALLS_PER_WORKER', 0))
+# A call's slot in the global count lapses this long after its worker stops renewing it.
+CALL_SLOT_LEASE = int(os.getenv('CALL_SLOT_LEASE', 30))
+# Calls over capacity are put on hold and retried ('hold') or dialled through to PERSONAL_PHONE_NUMBER ('transfer').
+OVERFLOW_ACTION = os.getenv('OVERFLOW_ACTION', 'hold').lower()
+OVERFLOW_HOLD_MESSAGE = os.getenv('OVERFLOW_HOLD_MESSAGE', 'All of our lines are busy right now. Please hold and we will connect you shortly.')
+OVERFLOW_RETRY_SECONDS = int(os.getenv('OVERFLOW_RETRY_SECONDS', 5))
+OVERFLOW_MAX_ATTEMPTS = int(os.getenv('OVERFLOW_MAX_ATTEMPTS', 12))
+OVERFLOW_TRANSFER_MESSAGE = "Please hold while we transfer your call."
+OVERFLOW_BUSY_MESSAGE = "Sorry, we are unable to take your call right now. Please try again later."
+# On SIGTERM a worker takes no new calls and gives live ones this long to finish; 0 ends them at once.
+CALL_DRAIN_TIMEOUT = float(os.getenv('CALL_DRAIN_TIMEOUT', 120))
+# How far ahead of real-time playback outbound audio is released to Twilio.
+OUTBOUND_AUDIO_LEAD = float(os.getenv('OUTBOUND_AUDIO_LEAD_MS', 200)) / 1000
+# Queue bound per call; a full queue makes the realtime reader wait instead of dropping speech.
+OUTBOUND_QUEUE_SECONDS = float(os.getenv('OUTBOUND_QUEUE_SECONDS', 60))
+# Local voice activity detection on the caller's audio, ahead of the realtime API's server VAD.
+LOCAL_VAD_ENABLED = os.getenv('LOCAL_VAD_ENABLED', 'false').lower() == 'true'
+# Frame energy (RMS in dBFS) at or above which a 20 ms frame counts as voiced.
+LOCAL_VAD_THRESHOLD_DBFS = float(os.getenv('LOCAL_VAD_THRESHOLD_DBFS', -40))
+# Consecutive voiced frames before the caller counts as speaking and assistant playback is paused.
+LOCAL_VAD_ONSET_FRAMES = int(os.getenv('LOCAL_VAD_ONSET_FRAMES', 3))
+# Playback paused on a local onset resumes where it stopped unless the realtime API's
+# speech_started confirms the barge-in within this long.
+LOCAL_VAD_CONFIRM_MS = int(os.getenv('LOCAL_VAD_CONFIRM_MS', 800))
+# Stop forwarding silence this long after the last voiced frame. Keep it above the server VAD's
+# silence_duration_ms, or the realtime API never sees the end of the caller's turn.
+LOCAL_VAD_SUPPRESS_SILENCE = os.getenv('LOCAL_VAD_SUPPRESS_SILENCE', 'false').lower() == 'true'
+LOCAL_VAD_HANGOVER_MS = int(os.getenv('LOCAL_VAD_HANGOVER_MS', 800))
+# Suppressed audio replayed in one append when speech resumes, matching the server VAD's prefix_padding_ms.
+LOCAL_VAD_PREFIX_MS = int(os.getenv('LOCAL_VAD_PREFIX_MS', 300))
+# Opt-in: send caller audio to the realtime API in appends of this many milliseconds instead of one
+# per 20 ms Twilio frame. Larger windows add up to the window minus 20 ms of inbound latency, and
+# delay the server VAD's end of turn by as much, for no CPU saving measured so far.
+INBOUND_BATCH_MS = int(os.getenv('INBOUND_BATCH_MS', 20))
+# Opt-in: record what calls receive from Twilio and the realtime API for benchmarks/replay.py.
+CALL_CAPTURE_DIR = os.getenv('CALL_CAPTURE_DIR')
+CALL_CAPTURE_RATE = float(os.getenv('CALL_CAPTURE_RATE', 1))
+# 'hash' keeps each audio payload's length and digest only; 'keep' stores the audio.
+CALL_CAPTURE_AUDIO = os.getenv('CALL_CAPTURE_AUDIO', 'hash').lower()
+CALL_CAPTURE_FLUSH_EVERY = 500
+
+class CallState(str, Enum):
+    TRANSFER = "transfer"
+    OVERFLOW = "overflow"
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 0.75, 1, 1.5, 2, 3, 5, 8, 13, 21)
+FAST_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+FIRST_AUDIO_LATENCY = Histogram('call_first_audio_seconds', 'Media stream accepted to first greeting audio sent to Twilio', buckets=LATENCY_BUCKETS)
+TURN_LATENCY = Histogram('call_turn_latency_seconds', 'speech_stopped to first response audio sent to Twilio', buckets=LATENCY_BUCKETS)
+FUNCTION_CALL_LATENCY = Histogram('call_function_latency_seconds', 'get_additional_context dispatch to CustomGPT answer and to first answer audio', ['stage'], buckets=LATENCY_BUCKETS)
+BARGE_IN_LATENCY = Histogram('call_barge_in_seconds', 'speech_started received to Twilio clear sent', buckets=FAST_BUCKETS)
+EVENT_LOOP_LAG = Histogram('event_loop_lag_seconds', 'Delay of a periodic event-loop wake-up beyond its schedule', buckets=FAST_BUCKETS)
+AUDIO_FRAMES_RELAYED = Counter('audio_frames_relayed_total', '20 ms g711_ulaw frames relayed', ['direction'])
+ACTIVE_CALLS = Gauge('active_calls', 'Media streams currently being relayed', multiprocess_mode='livesum')
+CALL_TASKS = Gauge('call_tasks', 'Tasks owned by live calls', multiprocess_mode='livesum')
+EVENT_LOOP_TASKS = Gauge('event_loop_tasks', 'Tasks pending on the event loop', multiprocess_mode='livesum')
+KB_CACHE_EVENTS = Counter('kb_cache_events_total', 'Knowledge-base answer cache lookups by outcome', ['event'])
+KB_PREFETCH_EVENTS = Counter('kb_prefetch_total', 'Speculative knowledge-base lookups by outcome', ['outcome'])
+OUTBOUND_QUEUE_FRAMES = Gauge('outbound_audio_queue_frames', 'Outbound audio frames queued for pacing to Twilio', multiprocess_mode='livesum')
+SMS_SESSION_EVENTS = Counter('sms_session_total', 'SMS caller session lookups by outcome', ['event'])
+KB_STREAM_EVENTS = Counter('kb_stream_total', 'Streamed knowledge-base answers by how they ended', ['outcome'])
+KB_PREFETCH_SAVED = Histogram('kb_prefetch_saved_seconds', 'Lookup time saved by reusing a speculative lookup', buckets=LATENCY_BUCKETS)
+LOCAL_VAD_LEAD = Histogram('local_vad_lead_seconds', 'Local speech onset ahead of the realtime API speech_started', buckets=FAST_BUCKETS)
+LOCAL_BARGE_INS = Counter('local_barge_in_total', 'Assistant playback paused on local speech onset')
+CALL_ADMISSIONS = Counter('call_admission_total', 'Call admission decisions by outcome', ['outcome'])
+REALTIME_PREWARMS = Counter('realtime_prewarm_total', 'Pre-warmed realtime sessions by outcome', ['outcome'])
+INBOUND_FRAMES_SUPPRESSED = Counter('audio_frames_suppressed_total', 'Silent 20 ms caller frames not forwarded to the realtime API')
+EVENT_LOOP_LAG_INTERVAL = 0.5
+# Frame counts are flushed to the shared counter in batches to keep the per-frame cost down.
+FRAME_FLUSH_EVERY = 50
 
 app = FastAPI()
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+# No formatter here uses the caller's location, thread or multiprocessing names, so skip collecting
+# them for every record (see "Optimization" in the logging HOWTO). Process ids stay for gunicorn.
+logging._srcfile = None
+logging.logThreads = False
+logging.logMultiprocessing = False
+
+class LogPayload:
+    """An event or text for a log message, field-selected and truncated only if the record is written."""
+    __slots__ = ('value', 'fields')
+
+    def __init__(self, value, fields=LOG_EVENT_FIELDS):
+        self.value = value
+        self.fields = fields
+
+    def __str__(self):
+        value = self.value
+        if isinstance(value, dict):
+            if self.fields:
+                value = {field: value[field] for field in self.fields if field in value}
+            try:
+                text = json_dumps(value)
+            except TypeError:
+                text = repr(value)
+        else:
+            text = str(value)
+        if len(text) > LOG_PAYLOAD_CHARS:
+            return f"{text[:LOG_PAYLOAD_CHARS]}...({len(text)} chars)"
+        return text
+
+class StructuredFormatter(logging.Formatter):
+    """One JSON object per record, with any fields passed through `extra`."""
+    RESERVED = frozenset(logging.makeLogRecord({}).__dict__) | {'message', 'asctime'}
+
+    def format(self, record):
+        entry = {
+            "ts": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in self.RESERVED:
+                entry[key] = value if isinstance(value, (str, int, float, bool, type(None))) else str(value)
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json_dumps(entry)
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    # QueueHandler.prepare() formats the message in the caller; the listener thread does it instead.
+    # Arguments are not copied, so only log values that are not mutated afterwards.
+    def prepare(self, record):
+        return record
+
+log_listener: Optional[logging.handlers.QueueListener] = None
+
+@app.on_event("startup")
+def start_log_queue():
+    # Started per worker, after gunicorn forks, so the listener thread lives in the process it serves.
+    global log_listener
+    root = logging.getLogger()
+    if LOG_FORMAT == 'json':
+        for handler in root.handlers:
+            handler.setFormatter(StructuredFormatter())
+    if not LOG_QUEUE_ENABLED or log_listener is not None:
+        return
+    handlers = root.handlers[:]
+    log_queue = queue.SimpleQueue()
+    log_listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    root.handlers = [DeferredQueueHandler(log_queue)]
+    log_listener.start()
+
+@app.on_event("shutdown")
+def stop_log_queue():
+    global log_listener
+    if log_listener is None:
+        return
+    log_listener.stop()
+    logging.getLogger().handlers = list(log_listener.handlers)
+    log_listener = None
+
+def log_realtime_event(event, session_id):
+    event_type = event['type']
+    rate = LOG_EVENT_SAMPLE_RATES.get(event_type, 1.0)
+    if rate < 1.0 and random.random() >= rate:
+        return
+    logger.info("Received event: %s::%s", event_type, LogPayload(event), extra={"event": event_type, "session_id": session_id})
 
 if not OPENAI_API_KEY:
     raise ValueError('Missing the OpenAI API key. Please set it in the .env file.')
 
+# One keep-alive connection pool per worker, shared by every call's outbound REST requests.
+http_session: Optional[aiohttp.ClientSession] = None
+
+def get_http_session() -> aiohttp.ClientSession:
+    global http_session
+    if http_session is None or http_session.closed:
+        connector = aiohttp.TCPConnector(limit=CUSTOMGPT_POOL_SIZE, keepalive_timeout=60, ttl_dns_cache=300)
+        http_session = aiohttp.ClientSession(connector=connector)
+    return http_session
+
+class TwilioRetryClient(RetryClient):
+    """Picks the retry policy by method: aiohttp_retry's default retries no errors but re-sends POSTs on 5xx."""
+
+    read_retry = ExponentialRetry(
+        attempts=TWILIO_MAX_ATTEMPTS, statuses={429}, exceptions={aiohttp.ClientError, asyncio.TimeoutError}
+    )
+    write_retry = ExponentialRetry(
+        attempts=TWILIO_MAX_ATTEMPTS, statuses={429}, exceptions={aiohttp.ClientConnectorError},
+        retry_all_server_errors=False
+    )
+
+    def request(self, method, url, retry_options=None, **kwargs):
+        if retry_options is None:
+            retry_options = self.read_retry if method in ('GET', 'HEAD', 'DELETE') else self.write_retry
+        return super().request(method, url, retry_options=retry_options, **kwargs)
+
+# Twilio REST client on a pooled aiohttp session, built lazily on the worker's event loop.
+twilio_client: Optional[Client] = None
+
+def get_twilio_client() -> Client:
+    global twilio_client
+    if twilio_client is None:
+        http_client = AsyncTwilioHttpClient(timeout=TWILIO_TIMEOUT)
+        http_client.session = TwilioRetryClient(client_session=http_client.session)
+        twilio_client = Client(account_sid, auth_token, http_client=http_client)
+        if TWILIO_API_BASE_URL:
+            twilio_client.api.base_url = TWILIO_API_BASE_URL
+    return twilio_client
+
+@app.on_event("shutdown")
+async def close_http_clients():
+    if http_session is not None and not http_session.closed:
+        await http_session.close()
+    if twilio_client is not None:
+        await twilio_client.http_client.close()
+    await redis_client.aclose()
+
+def call_state_key(session_id: str) -> str:
+    return f"call:{session_id}:state"
+
+async def set_call_state(session_id: str, state: CallState, ttl: int = CALL_STATE_TTL) -> None:
+    await redis_client.set(call_state_key(session_id), state.value, ex=ttl)
+
+async def get_call_state(session_id: str) -> Optional[CallState]:
+    state = await redis_client.get(call_state_key(session_id))
+    if state is None:
+        return None
+    try:
+        return CallState(state.decode('utf-8'))
+    except ValueError:
+        logger.warning(f"Unknown call state {state!r} for session {session_id}")
+        return None
+
+async def sample_event_loop_lag():
+    while True:
+        scheduled = time.monotonic() + EVENT_LOOP_LAG_INTERVAL
+        await asyncio.sleep(EVENT_LOOP_LAG_INTERVAL)
+        EVENT_LOOP_LAG.observe(max(0.0, time.monotonic() - scheduled))
+        EVENT_LOOP_TASKS.set(len(asyncio.all_tasks()))
+
+@app.on_event("startup")
+async def start_event_loop_lag_probe():
+    asyncio.create_task(sample_event_loop_lag())
+
+@app.get("/metrics")
+async def metrics():
+    # Under gunicorn every worker writes its samples to PROMETHEUS_MULTIPROC_DIR (see gunicorn.conf.py),
+    # so any worker answering the scrape reports the whole node.
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(await asyncio.to_thread(generate_latest, registry), media_type=CONTENT_TYPE_LATEST)
+
 @app.get("/", response_class=HTMLResponse)
 async def index_page():
     return "<h1>Twilio Media Stream Server is running!</h1>"
 
+@app.get("/health")
+async def health():
+    # A draining worker reports unhealthy so load balancers stop sending it new calls.
+    if session_scheduler.draining:
+        return Response(status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return {"status": "ok", "calls": len(session_scheduler.calls)}
+
 @app.api_route("/incoming-message", methods=["GET", "POST"])
 async def handle_incoming_message(
     request: Request,
@@ -127,26 +489,22 @@ async def handle_incoming_message(
     logger.info(f"Sender: {caller_number}")
     message = form_data.get('Body', 'Unknown')
     logger.info(f"Message: {message}")
-    session_id = create_session(api_key, project_id, caller_number)
     logger.info(f"Project::{project_id}")
 
     async def process_and_respond():
-        CustomGPT.api_key = api_key
-        logger.info(f"CustomGPT query sent:: {message}")
+        session_id = await sms_session(api_key, project_id, caller_number)
+        logger.info("CustomGPT query sent:: %s", LogPayload(message))
         instructions = "NOTE: Ensure the response is less than 1600 characters keep the answer short and concise."
-        conversation = CustomGPT.Conversation.send(
-            project_id=project_id,
-            session_id=session_id,
-            prompt=message,
-            custom_persona=instructions
-        )
-        response = conversation.parsed.data.openai_response
-        
-        client.messages.create(
-            body=response,
-            from_=twilio_number,
-            to=caller_number
-        )
+        response = await customgpt_send_message(api_key, project_id, session_id, message, instructions)
+
+        try:
+            await get_twilio_client().messages.create_async(
+                body=response,
+                from_=twilio_number,
+                to=caller_number
+            )
+        except Exception as e:
+            logger.error(f"Failed to send SMS reply to {caller_number}. Error: {e!r}")
 
     background_tasks.add_task(process_and_respond)
     return {"message": "Processing your message"}
@@ -154,19 +512,29 @@ async def handle_incoming_message(
 @app.api_route("/incoming-call", methods=["GET", "POST"])
 async def handle_incoming_call(
     request: Request,
-    background_tasks: BackgroundTasks,
     project_id: int,
     api_key: Optional[str] = CUSTOMGPT_API_KEY,
     phone_number: Optional[str] = None,
-    introduction: Optional[str] = DEFAULT_INTRO
+    introduction: Optional[str] = DEFAULT_INTRO,
+    overflow_attempt: int = 0
 ):
     logger.info(f"Introduction: {introduction}")
     form_data = await request.form() if request.method == "POST" else request.query_params
     caller_number = form_data.get('From', 'Unknown')
     logger.info(f"Caller: {caller_number}")
-    session_id = create_session(api_key, project_id, caller_number)
+    # The call is keyed by its own id so TwiML goes back at once; the CustomGPT session is created
+    # alongside and handed to the media stream by that key.
+    session_id = str(uuid.uuid4())
+    if session_scheduler.draining or not await claim_call_slot(session_id):
+        logger.warning(f"No capacity for call from {caller_number}, overflow attempt {overflow_attempt}")
+        CALL_ADMISSIONS.labels(outcome="overflow").inc()
+        response = overflow_response(request.url.hostname, request.query_params, overflow_attempt)
+        return HTMLResponse(content=str(response), media_type="application/xml")
+    CALL_ADMISSIONS.labels(outcome="admitted").inc()
     logger.info(f"Project::{project_id}")
     logger.info(f"Incoming call handled. Session ID: {session_id}")
+    start_customgpt_session(session_id, api_key, project_id, caller_number)
+    prewarm_realtime_session(session_id, phone_number, introduction)
     host = request.url.hostname
     call_id = form_data.get("CallSid")
     response = VoiceResponse()
@@ -178,10 +546,11 @@ async def handle_incoming_call(
     stream.parameter(name='api_key', value=api_key)
     connect.append(stream)
     response.append(connect)
-    if phone_number:
-        phone_number = urllib.parse.quote_plus(phone_number)
-    response.redirect(url=f"https://{host}/end-stream/{session_id}?phone_number={phone_number}")
-    background_tasks.add_task(start_recording, call_id, session_id, host)
+    # /end-stream gets the webhook's own parameters: phone_number to transfer to, and the rest,
+    # overflow_attempt included, to send the caller back through here if the stream cannot be served.
+    end_stream_query = urllib.parse.urlencode(request.query_params.multi_items())
+    response.redirect(url=f"https://{host}/end-stream/{session_id}?{end_stream_query}")
+    schedule_recording(call_id, session_id, host)
     return HTMLResponse(content=str(response), media_type="application/xml")
 
 @app.post("/log-recording/{session_id}")
@@ -196,13 +565,19 @@ async def log_recording(session_id: str, request: Request):
 
 
 @app.api_route("/end-stream/{session_id}", methods=["GET", "POST"])
-async def handle_end_call(request: Request, session_id: Optional[str] = None, phone_number: Optional[str] = None):
-    state = redis_client.get(session_id)
-    if state:
-        state = state.decode('utf-8') 
+async def handle_end_call(
+    request: Request,
+    session_id: Optional[str] = None,
+    phone_number: Optional[str] = None,
+    overflow_attempt: int = 0
+):
+    state = await get_call_state(session_id)
     logger.info(f"Ending Stream with state: {state}")
+    if state == CallState.OVERFLOW:
+        response = overflow_response(request.url.hostname, request.query_params, overflow_attempt)
+        return HTMLResponse(content=str(response), media_type="application/xml")
     response = VoiceResponse()
-    if state == "transfer":
+    if state == CallState.TRANSFER:
         dial = Dial()
         dial.number(phone_number)
         response.append(dial)
@@ -216,61 +591,109 @@ async def handle_media_stream(websocket: WebSocket, project_id: int, session_id:
     logger.info(f"WebSocket connection attempt. Session ID: {session_id}")
     await websocket.accept()
     logger.info(f"WebSocket connection accepted. Session ID: {session_id}")
+    if not session_scheduler.accepting():
+        await reject_media_stream(websocket, session_id)
+        return
     api_key = None
+    stream_sid = None
     # Create task termination event
     termination_event = asyncio.Event()
+    call_metrics = CallMetrics()
+    capture = start_call_capture(session_id, project_id, introduction)
+    greeting_key = greeting_cache_key(project_id, introduction)
 
-    async with websockets.connect(
-        'wss://api.openai.com/v1/realtime?model=gpt-4o-realtime-preview-2024-12-17',
-        extra_headers={
-            "Authorization": f"Bearer {OPENAI_API_KEY}",
-            "OpenAI-Beta": "realtime=v1"
-        }
-    ) as openai_ws:
+    async def start_stream():
+        """Read up to Twilio's start event and play the cached greeting; False if the caller hung up first."""
+        nonlocal stream_sid, api_key
+        while True:
+            try:
+                message = await websocket.receive_text()
+            except WebSocketDisconnect:
+                logger.info(f"Twilio WebSocket disconnected before the stream started. Session ID: {session_id}")
+                return False
+            if capture is not None:
+                capture.add('twilio', message)
+            data = json_loads(message)
+            if data['event'] == 'start':
+                break
+        api_key = data['start']['customParameters']['api_key']
+        stream_sid = data['start']['streamSid']
+        outbound.media_prefix = twilio_media_prefix(stream_sid)
+        call.touch()
+        logger.info(f"Incoming stream has started {stream_sid}")
+        cached_greeting = await greeting_lookup
+        if cached_greeting:
+            await outbound.put(base64.b64encode(cached_greeting["audio"]).decode('utf-8'))
+        return True
+
+    async with AsyncExitStack() as stack:
+        # The call counts against the worker from here, before the realtime connection is awaited.
+        call = await stack.enter_async_context(session_scheduler.open(session_id))
+        outbound = OutboundAudio(websocket, call_metrics)
+        stack.callback(outbound.close)
+        # Twilio's start event and the greeting cache need no realtime connection, so a cached
+        # greeting plays while the connection is still being made.
+        greeting_lookup = asyncio.ensure_future(load_cached_greeting(greeting_key))
+        stack.callback(greeting_lookup.cancel)
+        stream_start = asyncio.ensure_future(start_stream())
+        stack.callback(stream_start.cancel)
+        openai_ws = await stack.enter_async_context(realtime_session(session_id, phone_number, introduction))
         try:
-            handle_first_response = time.time()
+            customgpt_session = asyncio.ensure_future(resolve_customgpt_session(session_id))
             start_time = time.time()
-            stream_sid = None
-            await send_session_update(openai_ws, phone_number, introduction)
-            async def check_timeout():
-                logger.info(f"Checking inactivity. Session ID: {session_id}")
-                try:
-                    while not termination_event.is_set():
-                        current_time = time.time()
-                        diff = current_time - start_time
-                        if diff > 300:
-                            logger.info(f"Session timeout after 30 seconds of inactivity. Session ID: {session_id}")
-                            termination_event.set()
-                            await clear_buffer(websocket, openai_ws, stream_sid)
-                            await websocket.close()
-                            break
-                        await asyncio.sleep(5)
-                except Exception as e:
-                    raise e
+            cached_greeting = await greeting_lookup
+            # Deltas and transcript of the live greeting, captured until its response.done.
+            greeting_capture = None
+            greeting_transcript = None
+            prefetch = None
+            # Speculative lookups run in a conversation of their own, so unused ones leave no turns in the live one.
+            prefetch_session = None
+            # The caller's latest committed input item, and the items a function call has already answered.
+            input_item = None
+            answered_items = set()
+            if cached_greeting:
+                await send_cached_introduction(openai_ws, cached_greeting)
+            else:
+                await send_introduction(openai_ws, introduction)
+                greeting_capture = [] if GREETING_CACHE_ENABLED else None
+            inbound = InboundAudio(openai_ws, call_metrics)
+
+            async def relay_caller_audio(payload):
+                speech_started = await inbound.put(payload)
+                if speech_started and outbound.playing():
+                    # Stop the assistant now rather than after the realtime API's VAD round trip, but
+                    # keep what it has yet to say: a cough or line noise can trip this energy
+                    # threshold. The realtime API's speech_started flushes the audio and cancels the
+                    # response; without one, playback resumes where it stopped.
+                    logger.info(f"Local barge-in. Session ID: {session_id}")
+                    LOCAL_BARGE_INS.inc()
+                    outbound.pause(LOCAL_VAD_CONFIRM_MS / 1000)
+                    await clear_playback(websocket, stream_sid)
 
-            asyncio.create_task(check_timeout())
             async def receive_from_twilio():
-                nonlocal stream_sid, start_time, api_key
+                if not await stream_start:
+                    return
                 while not termination_event.is_set():
                     try:
                         message = await websocket.receive_text()
-                        data = json.loads(message)
-                        if data['event'] == 'media' and openai_ws.open:
-                            audio_append = {
-                                "type": "input_audio_buffer.append",
-                                "audio": data['media']['payload']
-                            }
-                            await openai_ws.send(json.dumps(audio_append))
-                        elif data['event'] == 'start':
-                            api_key = data['start']['customParameters']['api_key']
-                            stream_sid = data['start']['streamSid']
-                            start_time = time.time()
-                            logger.info(f"Incoming stream has started {stream_sid}")
+                        if capture is not None:
+                            capture.add('twilio', message)
+                        # Media frames arrive 50 times a second: forward their payload without parsing the document.
+                        payload = twilio_media_payload(message)
+                        if payload is not None:
+                            await relay_caller_audio(payload)
+                            continue
+                        data = json_loads(message)
+                        if data['event'] == 'media':
+                            await relay_caller_audio(data['media']['payload'])
+                        elif data['event'] == 'stop':
+                            await inbound.flush()
                         elif data['event'] == 'dtmf':
+                            await inbound.flush()
                             digit = data['dtmf']['digit']
                             logger.info(f"DTMF received: {digit}")
                             if digit == "0":
-                                redis_client.set(session_id, "transfer")
+                                await set_call_state(session_id, CallState.TRANSFER)
                                 logger.info("DTMF '0' detected, redirecting call...")
                                 termination_event.set()
                                 await websocket.close()
@@ -288,49 +711,85 @@ async def handle_media_stream(websocket: WebSocket, project_id: int, session_id:
                         logger.error(f"Error in receive_from_twilio: {e}")
                         break
 
+            async def relay_audio_delta(delta):
+                if greeting_capture is not None:
+                    greeting_capture.append(delta)
+                await outbound.put(delta)
+
             async def send_to_twilio():
-                nonlocal stream_sid, start_time
+                nonlocal stream_sid, start_time, greeting_capture, greeting_transcript, prefetch, prefetch_session, input_item
                 try:
                     async for openai_message in openai_ws:
                         try:
-                            response = json.loads(openai_message)
-                            start_time = time.time()
+                            call.touch()
+                            if capture is not None:
+                                capture.add('openai', openai_message)
+                            delta = realtime_audio_delta(openai_message)
+                            if delta is not None:
+                                await relay_audio_delta(delta)
+                                continue
+                            response = json_loads(openai_message)
                             if response['type'] in LOG_EVENT_TYPES:
-                                logger.info(f"Received event: {response['type']}::{response}")
+                                log_realtime_event(response, session_id)
                             if response['type'] == 'session.updated':
-                                logger.info(f"Session updated successfully: {response}")
+                                logger.info("Session updated successfully: %s", LogPayload(response))
                             if response['type'] == "input_audio_buffer.speech_started":
-                                logger.info(f"Input Audio Detected::{response}")
-                                await clear_buffer(websocket, openai_ws, stream_sid)
+                                speech_started_at = time.monotonic()
+                                logger.info("Input Audio Detected::%s", LogPayload(response))
+                                if inbound.vad is not None and inbound.vad.onset_at is not None:
+                                    LOCAL_VAD_LEAD.observe(speech_started_at - inbound.vad.onset_at)
+                                    inbound.vad.onset_at = None
+                                await clear_buffer(websocket, openai_ws, stream_sid, outbound)
+                                BARGE_IN_LATENCY.observe(time.monotonic() - speech_started_at)
+                            if response['type'] == 'input_audio_buffer.speech_stopped':
+                                call_metrics.speech_stopped()
+                            if response['type'] == 'input_audio_buffer.committed':
+                                input_item = response.get('item_id')
+                            if (KB_PREFETCH_ENABLED and response['type'] == 'conversation.item.input_audio_transcription.completed'
+                                    and response.get('transcript', '').strip() and response.get('item_id') not in answered_items):
+                                if prefetch is not None:
+                                    prefetch.discard()
+                                if prefetch_session is None:
+                                    prefetch_session = asyncio.ensure_future(create_prefetch_session(api_key, project_id))
+                                prefetch = KnowledgePrefetch(response['transcript'], response.get('item_id'), api_key, project_id, prefetch_session)
+
+                            if greeting_capture is not None:
+                                if response['type'] == 'response.audio_transcript.done':
+                                    greeting_transcript = response.get('transcript')
+                                elif response['type'] == 'response.done':
+                                    if response['response'].get('status') == 'completed' and greeting_capture and greeting_transcript:
+                                        run_in_background(store_cached_greeting(greeting_key, greeting_capture, greeting_transcript))
+                                    greeting_capture = None
 
                             if response['type'] == 'response.audio.delta' and response.get('delta'):
-                                try:
-                                    audio_payload = base64.b64encode(base64.b64decode(response['delta'])).decode('utf-8')
-                                    audio_delta = {
-                                        "event": "media",
-                                        "streamSid": stream_sid,
-                                        "media": {
-                                            "payload": audio_payload
-                                        }
-                                    }
-                                    await websocket.send_json(audio_delta)
-                                    start_time = time.time()
-                                except asyncio.TimeoutError:
-                                    logger.error("Timeout while sending audio data to Twilio")
-                                except Exception as e:
-                                    logger.error(f"Error processing audio data: {e}")                            
+                                await relay_audio_delta(response['delta'])
                             if response['type'] == 'response.function_call_arguments.done':
                                 try:
                                     function_name = response['name']
                                     call_id = response['call_id']
-                                    arguments = json.loads(response['arguments'])
+                                    arguments = json_loads(response['arguments'])
                                     if function_name == 'get_additional_context':
-                                        await play_typing(websocket, stream_sid)
+                                        call_metrics.function_dispatched()
+                                        outbound.hold(hold_audio_frames(project_id))
                                         logger.info("CustomGPT Started")
                                         start_time = time.time()
-                                        result = get_additional_context(arguments['query'], api_key, project_id, session_id)
+                                        result = None
+                                        # A transcript for this turn that completes from here on is not worth prefetching.
+                                        answered_items.add(input_item)
+                                        try:
+                                            if prefetch is not None and prefetch.item_id != input_item:
+                                                prefetch.discard()
+                                                prefetch = None
+                                            if prefetch is not None:
+                                                result = await prefetch.adopt(arguments['query'], await customgpt_session)
+                                                prefetch = None
+                                            if result is None:
+                                                result = await cached_additional_context(arguments['query'], api_key, project_id, await customgpt_session)
+                                        finally:
+                                            outbound.hold(None)
+                                        call_metrics.function_answered()
                                         logger.info(f"Clear Audio::Additional Context gained")
-                                        await clear_buffer(websocket, openai_ws, stream_sid)
+                                        await clear_buffer(websocket, openai_ws, stream_sid, outbound)
                                         end_time = time.time()
                                         elapsed_time = end_time - start_time
                                         logger.info(f"get_additional_context execution time: {elapsed_time:.4f} seconds")
@@ -346,18 +805,18 @@ async def handle_media_stream(websocket: WebSocket, project_id: int, session_id:
                                         await openai_ws.send(json.dumps({"type": "response.create"}))
                                     elif function_name == 'call_support':
                                         logger.info("Detected Term for calling support...")
-                                        redis_client.set(session_id, "transfer")
+                                        await set_call_state(session_id, CallState.TRANSFER)
                                         termination_event.set()
                                         raise Exception("Close Stream")
 
-                                except json.JSONDecodeError as e:
+                                except ValueError as e:
                                     logger.error(f"Error in json decode in function_call: {e}::{response}")
                                 except Exception as e:
                                     logger.error(f"Error in function_call.done: {e}")
                                     raise Exception("Close Stream")
 
 
-                        except json.JSONDecodeError as e:
+                        except ValueError as e:
                             logger.error(f"Error in json decode of response: {e}::{openai_message}")
 
                 except WebSocketDisconnect:
@@ -366,26 +825,610 @@ async def handle_media_stream(websocket: WebSocket, project_id: int, session_id:
                     logger.error(f"Error in send_to_twilio: {e}")
                     raise Exception("Close Stream")
 
-            await asyncio.gather(receive_from_twilio(), send_to_twilio())
+            call.track(outbound.task)
+            call.spawn(receive_from_twilio())
+            call.spawn(send_to_twilio())
+            # Either side ending ends the call; so does the scheduler's inactivity timeout.
+            await call.wait()
         except websockets.exceptions.ConnectionClosed:
             logger.error(f"WebSocket connection closed unexpectedly. Session ID: {session_id}")
         except Exception as e:
             logger.error(f"Unexpected error in handle_media_stream: {e}")
 
         finally:
+            await call.close()
+            customgpt_session.cancel()
+            if prefetch is not None:
+                prefetch.discard()
+            if prefetch_session is not None:
+                prefetch_session.cancel()
+            outbound.close()
+            call_metrics.flush()
             try:
                 await clear_buffer(websocket, openai_ws, stream_sid)
                 await openai_ws.close()
                 await websocket.close()
             except Exception:
                 logger.info(f"WebSocket connection closed. Session ID: {session_id}")
+            if capture is not None:
+                await capture.close()
+
+async def reject_media_stream(websocket, session_id):
+    """Turn away a stream this worker has no room for; /end-stream then answers with overflow TwiML."""
+    logger.warning(f"Worker at capacity or draining, turning the media stream away. Session ID: {session_id}")
+    CALL_ADMISSIONS.labels(outcome="stream_overflow").inc()
+    task = prewarmed_sessions.get(session_id)
+    if task is not None:
+        reap_prewarmed_session(session_id, task)
+    try:
+        await set_call_state(session_id, CallState.OVERFLOW)
+    except Exception as e:
+        logger.error(f"Setting overflow state failed. Session ID: {session_id}. Error: {e!r}")
+    await release_call_slot(session_id)
+    await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+
+class CallSession:
+    """One live call's inactivity deadline and the tasks that make it up."""
+
+    def __init__(self, scheduler, session_id, timeout):
+        self.scheduler = scheduler
+        self.session_id = session_id
+        self.timeout = timeout
+        self.deadline = time.monotonic() + timeout
+        self.tasks = set()
+        self.closed = False
+
+    def touch(self):
+        # Only the deadline moves; the scheduler catches up with it when the old one comes due.
+        self.deadline = time.monotonic() + self.timeout
+
+    def spawn(self, coro):
+        return self.track(asyncio.create_task(coro))
+
+    def track(self, task):
+        self.tasks.add(task)
+        CALL_TASKS.inc()
+        task.add_done_callback(self.task_done)
+        return task
+
+    def task_done(self, task):
+        self.tasks.discard(task)
+        CALL_TASKS.dec()
+        if not task.cancelled():
+            # Marks the exception retrieved; wait() re-raises it for the handler to log.
+            task.exception()
+
+    async def wait(self):
+        """Until the first of the call's tasks finishes or the call is expired."""
+        if not self.tasks:
+            return
+        done, _ = await asyncio.wait(set(self.tasks), return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if not task.cancelled():
+                task.result()
+
+    def expire(self):
+        logger.info(f"Session timeout after {self.timeout:.0f} seconds of inactivity. Session ID: {self.session_id}")
+        self.cancel()
+
+    def cancel(self):
+        for task in list(self.tasks):
+            task.cancel()
+
+    async def close(self):
+        """Cancel whatever is still running, wait for it to unwind and give up the call's slot."""
+        if self.closed:
+            return
+        self.closed = True
+        self.scheduler.calls.discard(self)
+        ACTIVE_CALLS.dec()
+        tasks = list(self.tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await release_call_slot(self.session_id)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+class SessionScheduler:
+    """Inactivity deadlines of every live call on this worker, in one timer heap.
+
+    A single task sleeps until the earliest deadline, so idle calls cost nothing between events.
+    """
+
+    def __init__(self):
+        self.calls = set()
+        self.heap = []
+        self.sequence = itertools.count()
+        self.wakeup = None
+        self.task = None
+        self.draining = False
+        self.drain_task = None
+
+    def accepting(self):
+        return not self.draining and (MAX_CALLS_PER_WORKER <= 0 or len(self.calls) < MAX_CALLS_PER_WORKER)
+
+    def open(self, session_id, timeout=CALL_INACTIVITY_TIMEOUT):
+        call = CallSession(self, session_id, timeout)
+        self.calls.add(call)
+        ACTIVE_CALLS.inc()
+        heapq.heappush(self.heap, (call.deadline, next(self.sequence), call))
+        if self.task is None or self.task.done():
+            # Created on first use so the event and task belong to the worker's running loop.
+            self.wakeup = asyncio.Event()
+            self.task = asyncio.create_task(self.run())
+        elif self.heap[0][2] is call:
+            self.wakeup.set()
+        return call
+
+    async def run(self):
+        while True:
+            now = time.monotonic()
+            while self.heap and self.heap[0][0] <= now:
+                _, _, call = heapq.heappop(self.heap)
+                if call.closed:
+                    continue
+                if call.deadline > now:
+                    heapq.heappush(self.heap, (call.deadline, next(self.sequence), call))
+                    continue
+                try:
+                    call.expire()
+                except Exception as e:
+                    logger.error(f"Error expiring session {call.session_id}: {e!r}")
+            delay = self.heap[0][0] - now if self.heap else None
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def start_drain(self, exit_handler):
+        """SIGTERM: stop taking calls and let the live ones finish before the server shuts down."""
+        if self.draining:
+            # A second SIGTERM does not wait any longer.
+            exit_handler(signal.SIGTERM, None)
+            return
+        self.draining = True
+        self.drain_task = asyncio.create_task(self.drain(exit_handler))
+
+    async def drain(self, exit_handler):
+        try:
+            logger.info(f"Draining {len(self.calls)} calls for up to {CALL_DRAIN_TIMEOUT:.0f} seconds")
+            deadline = time.monotonic() + CALL_DRAIN_TIMEOUT
+            while self.calls and time.monotonic() < deadline:
+                await asyncio.sleep(0.5)
+            if self.calls:
+                # Out of time: end the calls left, and /end-stream puts each caller back through /incoming-call.
+                calls = list(self.calls)
+                logger.warning(f"Drain deadline reached, handing {len(calls)} calls back to Twilio")
+                CALL_ADMISSIONS.labels(outcome="drain_handoff").inc(len(calls))
+                await asyncio.gather(*(set_call_state(call.session_id, CallState.OVERFLOW) for call in calls), return_exceptions=True)
+                for call in calls:
+                    call.cancel()
+                deadline = time.monotonic() + 5
+                while self.calls and time.monotonic() < deadline:
+                    await asyncio.sleep(0.1)
+            logger.info("Drain complete")
+        finally:
+            exit_handler(signal.SIGTERM, None)
+
+session_scheduler = SessionScheduler()
+
+@app.on_event("startup")
+async def install_drain_handler():
+    # uvicorn (also under gunicorn's uvicorn worker) takes SIGTERM before startup and, on it, closes every
+    # websocket at once. Take the signal over and pass it on to uvicorn once the calls have drained.
+    exit_handler = signal.getsignal(signal.SIGTERM)
+    if CALL_DRAIN_TIMEOUT <= 0 or not callable(exit_handler):
+        return
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, session_scheduler.start_drain, exit_handler)
+    except (NotImplementedError, RuntimeError) as e:
+        logger.warning(f"Call draining on SIGTERM is unavailable: {e!r}")
+
+# Sorted set of every admitted call's session_id, scored by when its slot lapses.
+CALL_SLOTS_KEY = "calls:active"
+
+async def claim_call_slot(session_id):
+    """Reserve the call a slot under MAX_CALLS; True if it got one.
+
+    Slots are members of one sorted set scored by lease expiry, so the count stays right when a worker
+    dies with calls on it: their leases lapse instead of leaking.
+    """
+    if MAX_CALLS <= 0:
+        return True
+    now = time.time()
+    try:
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.zremrangebyscore(CALL_SLOTS_KEY, '-inf', now)
+            pipe.zadd(CALL_SLOTS_KEY, {session_id: now + CALL_SLOT_LEASE})
+            pipe.zcard(CALL_SLOTS_KEY)
+            _, _, taken = await pipe.execute()
+        if taken <= MAX_CALLS:
+            return True
+        await redis_client.zrem(CALL_SLOTS_KEY, session_id)
+        return False
+    except Exception as e:
+        # Redis trouble should not turn callers away.
+        logger.error(f"Call slot claim failed, admitting the call. Session ID: {session_id}. Error: {e!r}")
+        return True
+
+async def release_call_slot(session_id):
+    if MAX_CALLS <= 0:
+        return
+    try:
+        await redis_client.zrem(CALL_SLOTS_KEY, session_id)
+    except Exception as e:
+        logger.error(f"Call slot release failed. Session ID: {session_id}. Error: {e!r}")
+
+async def renew_call_slots():
+    """Extend the leases of this worker's live calls well before they lapse."""
+    while True:
+        await asyncio.sleep(CALL_SLOT_LEASE / 3)
+        if not session_scheduler.calls:
+            continue
+        expiry = time.time() + CALL_SLOT_LEASE
+        try:
+            await redis_client.zadd(CALL_SLOTS_KEY, {call.session_id: expiry for call in session_scheduler.calls})
+        except Exception as e:
+            logger.error(f"Call slot renewal failed: {e!r}")
+
+@app.on_event("startup")
+async def start_call_slot_renewal():
+    if MAX_CALLS > 0:
+        asyncio.create_task(renew_call_slots())
+
+def overflow_response(host, query_params, attempt):
+    """TwiML for a call there is no capacity for: hold and retry /incoming-call, or transfer."""
+    response = VoiceResponse()
+    if (OVERFLOW_ACTION == 'transfer' and PERSONAL_PHONE_NUMBER) or attempt >= OVERFLOW_MAX_ATTEMPTS:
+        if PERSONAL_PHONE_NUMBER:
+            response.say(OVERFLOW_TRANSFER_MESSAGE)
+            response.dial(PERSONAL_PHONE_NUMBER)
+        else:
+            response.say(OVERFLOW_BUSY_MESSAGE)
+            response.hangup()
+        return response
+    if attempt == 0:
+        response.say(OVERFLOW_HOLD_MESSAGE)
+    response.pause(length=OVERFLOW_RETRY_SECONDS)
+    params = [(name, value) for name, value in query_params.multi_items() if name != 'overflow_attempt']
+    params.append(('overflow_attempt', attempt + 1))
+    response.redirect(url=f"https://{host}/incoming-call?{urllib.parse.urlencode(params)}")
+    return response
+
+class OutboundAudio:
+    """Paces one call's audio to Twilio in real time from a bounded queue.
+
+    The realtime reader only enqueues, so a slow Twilio socket no longer stalls it, and a
+    barge-in drops everything that has not been sent yet. A pause takes back what Twilio has not
+    played yet, so playback can resume where it stopped.
+    """
+
+    def __init__(self, websocket, call_metrics):
+        self.websocket = websocket
+        self.call_metrics = call_metrics
+        self.media_prefix = twilio_media_prefix(None)
+        self.frames = deque()
+        self.max_frames = int(OUTBOUND_QUEUE_SECONDS * ULAW_BYTES_PER_SECOND / OUTBOUND_FRAME_BYTES)
+        self.wakeup = asyncio.Event()
+        self.has_room = asyncio.Event()
+        self.has_room.set()
+        # When the audio already handed to Twilio finishes playing.
+        self.playout_until = 0.0
+        # (frame, ends_at, held) of frames handed to Twilio that may not have finished playing.
+        self.unplayed = deque()
+        # Frames at the front of the queue that were sent once already and taken back by pause().
+        self.replays = 0
+        self.paused_until = 0.0
+        # Shared hold clip frames looped whenever nothing else is queued, and the next one to send.
+        self.hold_frames = None
+        self.hold_position = 0
+        self.task = asyncio.create_task(self.run())
+
+    async def put(self, payload):
+        for offset in range(0, len(payload), OUTBOUND_FRAME_CHARS):
+            while len(self.frames) >= self.max_frames:
+                self.has_room.clear()
+                await self.has_room.wait()
+            self.frames.append(payload[offset:offset + OUTBOUND_FRAME_CHARS])
+            OUTBOUND_QUEUE_FRAMES.inc()
+            self.wakeup.set()
+
+    def flush(self):
+        OUTBOUND_QUEUE_FRAMES.dec(len(self.frames))
+        self.frames.clear()
+        self.unplayed.clear()
+        self.replays = 0
+        self.paused_until = 0.0
+        # Twilio's own buffer is emptied by the clear message that follows.
+        self.playout_until = time.monotonic()
+        self.has_room.set()
+        self.wakeup.set()
+
+    def pause(self, seconds):
+        """Hold back audio for up to seconds, requeueing what Twilio has not finished playing.
+
+        Twilio's buffer is emptied by the clear message that follows; the frame playing at that
+        moment is sent again in full.
+        """
+        now = time.monotonic()
+        taken_back = [frame for frame, ends_at, held in self.unplayed if ends_at > now and not held]
+        self.unplayed.clear()
+        self.frames.extendleft(reversed(taken_back))
+        OUTBOUND_QUEUE_FRAMES.inc(len(taken_back))
+        self.replays += len(taken_back)
+        self.playout_until = now
+        self.paused_until = now + seconds
+        self.wakeup.set()
+
+    def hold(self, frames):
+        """Loop frames, paced like any other audio, until hold(None)."""
+        self.hold_frames = frames or None
+        self.hold_position = 0
+        self.wakeup.set()
+
+    def playing(self):
+        return bool(self.frames) or self.playout_until > time.monotonic()
+
+    def close(self):
+        self.task.cancel()
+        OUTBOUND_QUEUE_FRAMES.dec(len(self.frames))
+        self.frames.clear()
+        self.has_room.set()
+
+    async def run(self):
+        try:
+            while True:
+                delay = None
+                if self.frames or self.hold_frames:
+                    delay = max(self.paused_until, self.playout_until - OUTBOUND_AUDIO_LEAD) - time.monotonic()
+                    if delay <= 0:
+                        await self.send_frame()
+                        continue
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error sending audio to Twilio: {e}")
+
+    async def send_frame(self):
+        held = not self.frames
+        replay = False
+        if held:
+            frame = self.hold_frames[self.hold_position]
+            self.hold_position = (self.hold_position + 1) % len(self.hold_frames)
+        else:
+            frame = self.frames.popleft()
+            OUTBOUND_QUEUE_FRAMES.dec()
+            self.has_room.set()
+            if self.replays:
+                self.replays -= 1
+                replay = True
+        await self.websocket.send_text(self.media_prefix + frame + MEDIA_SUFFIX)
+        size = len(frame) * 3 // 4 - frame.count('=', -2)
+        now = time.monotonic()
+        self.playout_until = max(self.playout_until, now) + size / ULAW_BYTES_PER_SECOND
+        while self.unplayed and self.unplayed[0][1] <= now:
+            self.unplayed.popleft()
+        self.unplayed.append((frame, self.playout_until, held))
+        if not held and not replay:
+            # Hold audio is not the assistant speaking, so it stays out of the latency marks.
+            self.call_metrics.audio_sent(size // ULAW_FRAME_BYTES)
+
+class InboundAudio:
+    """Relays one caller's audio to the realtime API, coalescing 20 ms frames into larger appends.
+
+    Frames are decoded and re-encoded only when batching or local VAD needs the raw bytes:
+    base64 of a 160-byte frame ends in padding, so payloads cannot simply be concatenated.
+    """
+
+    def __init__(self, openai_ws, call_metrics):
+        self.openai_ws = openai_ws
+        self.call_metrics = call_metrics
+        self.batch_frames = max(1, INBOUND_BATCH_MS // 20)
+        self.vad = LocalVad() if LOCAL_VAD_ENABLED else None
+        self.chunks = []
+        self.frames = 0
+
+    async def put(self, payload):
+        """Queue one Twilio frame; True when local VAD saw the caller start speaking."""
+        if self.vad is None and self.batch_frames == 1:
+            await self.send(payload, 1)
+            return False
+        raw = binascii.a2b_base64(payload)
+        speech_started = False
+        frames = 1
+        if self.vad is not None:
+            raw, speech_started = self.vad.process(raw)
+            if raw is None:
+                self.call_metrics.frame_suppressed()
+                await self.flush()
+                return speech_started
+            frames = self.vad.frames_forwarded
+        self.chunks.append(raw)
+        self.frames += frames
+        # Speech onset goes out at once so the server VAD is not held back by the window.
+        if self.frames >= self.batch_frames or speech_started:
+            await self.flush()
+        return speech_started
+
+    async def flush(self):
+        if not self.chunks:
+            return
+        raw = b"".join(self.chunks)
+        frames = self.frames
+        self.chunks = []
+        self.frames = 0
+        await self.send(binascii.b2a_base64(raw, newline=False).decode('ascii'), frames)
+
+    async def send(self, payload, frames):
+        if self.openai_ws.open:
+            await self.openai_ws.send(audio_append_message(payload))
+            self.call_metrics.frame_received(frames)
+
+class CallMetrics:
+    """Latency marks for one call, observed into the Prometheus histograms as events complete."""
+
+    def __init__(self):
+        self.accepted_at = time.monotonic()
+        self.first_audio_sent = False
+        self.speech_stopped_at = None
+        self.function_dispatched_at = None
+        self.inbound_frames = 0
+        self.outbound_frames = 0
+        self.suppressed_frames = 0
+
+    def frame_received(self, frames=1):
+        self.inbound_frames += frames
+        if self.inbound_frames >= FRAME_FLUSH_EVERY:
+            self.flush()
+
+    def frame_suppressed(self):
+        self.suppressed_frames += 1
+        if self.suppressed_frames >= FRAME_FLUSH_EVERY:
+            self.flush()
+
+    def audio_sent(self, frames):
+        now = time.monotonic()
+        if not self.first_audio_sent:
+            self.first_audio_sent = True
+            FIRST_AUDIO_LATENCY.observe(now - self.accepted_at)
+        if self.speech_stopped_at is not None:
+            TURN_LATENCY.observe(now - self.speech_stopped_at)
+            self.speech_stopped_at = None
+        if self.function_dispatched_at is not None:
+            FUNCTION_CALL_LATENCY.labels(stage='first_audio').observe(now - self.function_dispatched_at)
+            self.function_dispatched_at = None
+        self.outbound_frames += frames
+        if self.outbound_frames >= FRAME_FLUSH_EVERY:
+            self.flush()
+
+    def speech_stopped(self):
+        self.speech_stopped_at = time.monotonic()
+
+    def function_dispatched(self):
+        self.function_dispatched_at = time.monotonic()
+
+    def function_answered(self):
+        if self.function_dispatched_at is not None:
+            FUNCTION_CALL_LATENCY.labels(stage='answer').observe(time.monotonic() - self.function_dispatched_at)
+
+    def flush(self):
+        if self.inbound_frames:
+            AUDIO_FRAMES_RELAYED.labels(direction='inbound').inc(self.inbound_frames)
+            self.inbound_frames = 0
+        if self.outbound_frames:
+            AUDIO_FRAMES_RELAYED.labels(direction='outbound').inc(self.outbound_frames)
+            self.outbound_frames = 0
+        if self.suppressed_frames:
+            INBOUND_FRAMES_SUPPRESSED.inc(self.suppressed_frames)
+            self.suppressed_frames = 0
+
+class CallCapture:
+    """Opt-in record of one call's incoming traffic: Twilio's media, start, dtmf and stop events and
+    every realtime API event, each stamped with seconds since the stream was accepted.
+
+    Messages are kept as received; parsing, scrubbing and writing the gzipped JSON lines happen in
+    a worker thread, in order. benchmarks/replay.py plays a capture back through the app.
+    """
+
+    def __init__(self, session_id, project_id, introduction):
+        self.path = os.path.join(CALL_CAPTURE_DIR, f"{session_id}.jsonl.gz")
+        self.started = time.monotonic()
+        self.records = [{
+            "capture": 1, "session_id": session_id, "project_id": project_id, "introduction": introduction,
+            "audio": CALL_CAPTURE_AUDIO, "started_at": time.time(),
+        }]
+        self.writing = None
+
+    def add(self, source, message):
+        self.records.append((time.monotonic() - self.started, source, message))
+        if len(self.records) >= CALL_CAPTURE_FLUSH_EVERY:
+            self.flush()
+
+    def flush(self):
+        records, self.records = self.records, []
+        self.writing = asyncio.ensure_future(self.write(self.writing, records))
+
+    async def write(self, previous, records):
+        if previous is not None:
+            await previous
+        try:
+            await asyncio.to_thread(write_capture_records, self.path, records)
+        except Exception as e:
+            logger.error(f"Writing call capture {self.path} failed: {e!r}")
+
+    async def close(self):
+        self.flush()
+        await self.writing
+        logger.info(f"Call captured to {self.path}")
+
+def start_call_capture(session_id, project_id, introduction):
+    if not CALL_CAPTURE_DIR or random.random() >= CALL_CAPTURE_RATE:
+        return None
+    return CallCapture(session_id, project_id, introduction)
+
+def captured_audio(payload):
+    if CALL_CAPTURE_AUDIO == 'keep':
+        return payload
+    return {
+        "bytes": len(payload) * 3 // 4 - payload.count('=', -2),
+        "sha1": hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16],
+    }
+
+def write_capture_records(path, records):
+    lines = []
+    for record in records:
+        if isinstance(record, dict):
+            lines.append(json.dumps(record, separators=(',', ':')))
+            continue
+        elapsed, source, message = record
+        try:
+            event = json.loads(message)
+        except ValueError:
+            continue
+        if source == 'twilio':
+            if event.get('event') == 'media':
+                event['media']['payload'] = captured_audio(event['media']['payload'])
+            elif event.get('event') == 'start':
+                event['start'].get('customParameters', {}).pop('api_key', None)
+        elif event.get('type') == 'response.audio.delta':
+            event['delta'] = captured_audio(event['delta'])
+        lines.append(json.dumps({"t": round(elapsed, 4), "src": source, "msg": event}, separators=(',', ':')))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Appended gzip members read back as one stream.
+    with gzip.open(path, 'at', encoding='utf-8') as capture_file:
+        capture_file.write('\n'.join(lines) + '\n')
+
+# The event loop keeps only weak references to tasks; fire-and-forget ones are held here until done.
+background_tasks = set()
+
+def keep_until_done(task):
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+def run_in_background(coro):
+    return keep_until_done(asyncio.create_task(coro))
 
-def start_recording(call_id: str, session_id: str, host: str):
-    # Delay the recording by 3 seconds
-    time.sleep(2)
-    # Start the recording
+def schedule_recording(call_id: str, session_id: str, host: str):
+    # A timer on the event loop rather than a threadpool slot sleeping through the delay.
+    asyncio.get_running_loop().call_later(
+        RECORDING_DELAY, lambda: run_in_background(start_recording(call_id, session_id, host))
+    )
+
+async def start_recording(call_id: str, session_id: str, host: str):
     try:
-        recording = client.calls(call_id).recordings.create(
+        recording = await get_twilio_client().calls(call_id).recordings.create_async(
             recording_status_callback=f"https://{host}/log-recording/{session_id}",
             recording_status_callback_event=["in-progress", "completed"],
             recording_channels="dual",
@@ -394,7 +1437,95 @@ def start_recording(call_id: str, session_id: str, host: str):
     except Exception as e:
         logger.error(f"Failed to start recording for Call SID: {call_id}. Error: {e}")
 
-def get_additional_context(query, api_key, project_id, session_id):
+async def customgpt_send_message(api_key, project_id, session_id, prompt, custom_persona, timeout=CUSTOMGPT_TIMEOUT):
+    http = get_http_session()
+    async with http.post(
+        f"{CUSTOMGPT_BASE_URL}/api/v1/projects/{project_id}/conversations/{session_id}/messages",
+        params={"stream": 0, "lang": "en"},
+        json={"prompt": prompt, "custom_persona": custom_persona},
+        headers={"Authorization": f"Bearer {api_key}", "Accept": "application/json"},
+        timeout=aiohttp.ClientTimeout(total=timeout),
+    ) as response:
+        response.raise_for_status()
+        body = await response.json()
+    return body["data"]["openai_response"]
+
+SENTENCE_END = re.compile(r'[.!?]+["\')\]]*\s')
+# Words whose trailing period does not end a sentence.
+ABBREVIATIONS = frozenset({'mr', 'mrs', 'ms', 'dr', 'st', 'jr', 'sr', 'vs', 'e.g', 'i.e'})
+
+def spoken_answer_cutoff(text):
+    """The part of a partial answer to speak, and why it is enough, or None to keep reading.
+
+    A sentence counts once the whitespace after it has arrived, so decimals and a terminator at the
+    end of a chunk are not mistaken for its end.
+    """
+    sentences, end = 0, 0
+    for match in SENTENCE_END.finditer(text):
+        if match.end() > KB_STREAM_MAX_CHARS:
+            break
+        words = text[end:match.start()].split()
+        if words and words[-1].lower() in ABBREVIATIONS:
+            continue
+        sentences, end = sentences + 1, match.end()
+        if sentences >= KB_STREAM_MAX_SENTENCES:
+            return text[:end].strip(), "sentences"
+    if len(text) < KB_STREAM_MAX_CHARS:
+        return None
+    # Over the character budget: stop at the last whole sentence, or failing that the last whole word.
+    if not end:
+        end = text.rfind(' ', 0, KB_STREAM_MAX_CHARS)
+        if end <= 0:
+            end = KB_STREAM_MAX_CHARS
+    return text[:end].strip(), "chars"
+
+async def customgpt_stream_message(api_key, project_id, session_id, prompt, custom_persona, timeout=CUSTOMGPT_TIMEOUT):
+    """Like customgpt_send_message, but read the answer as it is generated and close the request
+    as soon as spoken_answer_cutoff has enough of it."""
+    http = get_http_session()
+    answer = ''
+    async with http.post(
+        f"{CUSTOMGPT_BASE_URL}/api/v1/projects/{project_id}/conversations/{session_id}/messages",
+        params={"stream": 1, "lang": "en"},
+        json={"prompt": prompt, "custom_persona": custom_persona},
+        headers={"Authorization": f"Bearer {api_key}", "Accept": "text/event-stream"},
+        timeout=aiohttp.ClientTimeout(total=timeout),
+    ) as response:
+        response.raise_for_status()
+        data = []
+        async for line in response.content:
+            line = line.decode('utf-8').rstrip('\r\n')
+            if line.startswith('data:'):
+                data.append(line[5:].lstrip(' '))
+                continue
+            # Server-sent events end at a blank line.
+            if line or not data:
+                continue
+            event = json_loads('\n'.join(data))
+            data = []
+            if event.get('status') == 'error':
+                raise Exception(f"CustomGPT stream error: {event}")
+            if event.get('status') == 'finish':
+                answer = answer or event.get('openai_response') or ''
+                break
+            answer += event.get('message') or ''
+            cutoff = spoken_answer_cutoff(answer)
+            if cutoff is not None:
+                # Dropping the connection stops the rest of the answer being generated and sent.
+                response.close()
+                answer, outcome = cutoff
+                KB_STREAM_EVENTS.labels(outcome=outcome).inc()
+                return answer
+    if not answer.strip():
+        raise Exception("CustomGPT stream ended without an answer")
+    KB_STREAM_EVENTS.labels(outcome="complete").inc()
+    return answer.strip()
+
+def customgpt_retry_delay(tries):
+    # Exponential backoff with jitter so retrying calls don't stampede the API together.
+    return CUSTOMGPT_RETRY_BACKOFF * (2 ** (tries - 1)) + random.uniform(0, CUSTOMGPT_RETRY_BACKOFF)
+
+async def get_additional_context(query, api_key, project_id, session_id):
     custom_persona = """
     You are an AI assistant tasked with answering user queries based on a knowledge base. The user query is transcribed from voice audio, so there may be transcription errors.
 
@@ -406,41 +1537,453 @@ def get_additional_context(query, api_key, project_id, session_id):
     """
 
     tries = 0
-    max_retries = 2
-    while tries <= max_retries:
+    while tries <= CUSTOMGPT_MAX_RETRIES:
         try:
-            CustomGPT.api_key = api_key
-            logger.info(f"CustomGPT query sent:: {query}")
-            conversation = CustomGPT.Conversation.send(
-                project_id=project_id, 
-                session_id=session_id, 
-                prompt=query, 
-                custom_persona=custom_persona
-            )
-            logger.info(f"CustomGPT response: {conversation}")
-            return conversation.parsed.data.openai_response  # Correct f-string is unnecessary
+            logger.info("CustomGPT query sent:: %s", LogPayload(query))
+            send_message = customgpt_stream_message if KB_STREAM_ENABLED else customgpt_send_message
+            response = await send_message(api_key, project_id, session_id, query, custom_persona)
+            logger.info("CustomGPT response: %s", LogPayload(response))
+            return response
         except Exception as e:
-            logger.error(f"Get Additional Context failed::Try {tries}::Error: {conversation}")
-            time.sleep(2)
+            logger.error(f"Get Additional Context failed::Try {tries}::Error: {e!r}")
         tries += 1
+        if tries <= CUSTOMGPT_MAX_RETRIES:
+            await asyncio.sleep(customgpt_retry_delay(tries))
+
+    return KB_FALLBACK_ANSWER
+
+class LocalAnswerCache:
+    """In-process LRU hot tier in front of Redis, so repeat questions on a worker skip the network."""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        answer, expires_at = entry
+        if expires_at < time.time():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return answer
+
+    def set(self, key, answer, ttl):
+        self.entries[key] = (answer, time.time() + min(ttl, self.ttl))
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+local_answer_cache = LocalAnswerCache(KB_CACHE_LOCAL_SIZE, KB_CACHE_LOCAL_TTL)
+
+def normalize_query(query):
+    query = re.sub(r"[^\w\s]", " ", query.lower())
+    return " ".join(query.split())
+
+def kb_cache_ttl(project_id):
+    return KB_CACHE_PROJECT_TTLS.get(int(project_id), KB_CACHE_TTL)
+
+def kb_cache_keys(project_id):
+    prefix = f"kb:{project_id}"
+    return f"{prefix}:answer:", f"{prefix}:lru", f"{prefix}:emb", f"{prefix}:stats"
+
+async def kb_cache_write(project_id, write):
+    try:
+        await write
+    except Exception as e:
+        logger.error(f"KB cache write failed::{project_id}::Error: {e!r}")
+
+async def redis_count_kb_cache_event(project_id, event):
+    _, _, _, stats_key = kb_cache_keys(project_id)
+    await redis_client.hincrby(stats_key, event, 1)
+
+def record_kb_cache_event(project_id, event):
+    KB_CACHE_EVENTS.labels(event=event).inc()
+    # Stats and stores are written after the answer goes back, not while the caller waits on hold.
+    run_in_background(kb_cache_write(project_id, redis_count_kb_cache_event(project_id, event)))
+
+async def redis_lookup_answer(project_id, digest):
+    answer_prefix, lru_key, _, _ = kb_cache_keys(project_id)
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.get(answer_prefix + digest)
+        pipe.zadd(lru_key, {digest: time.time()}, xx=True)
+        answer, _ = await pipe.execute()
+    return answer.decode('utf-8') if answer else None
+
+async def redis_store_answer(project_id, digest, answer, embedding=None):
+    answer_prefix, lru_key, emb_key, _ = kb_cache_keys(project_id)
+    ttl = kb_cache_ttl(project_id)
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.set(answer_prefix + digest, answer, ex=ttl)
+        pipe.zadd(lru_key, {digest: time.time()})
+        pipe.expire(lru_key, ttl)
+        if embedding is not None:
+            pipe.hset(emb_key, digest, array.array('f', embedding).tobytes())
+            pipe.expire(emb_key, ttl)
+        pipe.zcard(lru_key)
+        size = (await pipe.execute())[-1]
+    if size > KB_CACHE_MAX_ENTRIES:
+        evicted = [digest for digest, _ in await redis_client.zpopmin(lru_key, size - KB_CACHE_MAX_ENTRIES)]
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.delete(*[answer_prefix + digest.decode('utf-8') for digest in evicted])
+            pipe.hdel(emb_key, *evicted)
+            await pipe.execute()
+
+def best_embedding_match(embedding, candidates):
+    best_digest, best_score = None, KB_CACHE_SIMILARITY
+    for digest, raw in candidates.items():
+        candidate = array.array('f')
+        candidate.frombytes(raw)
+        # Embeddings are unit length, so the dot product is the cosine similarity.
+        score = math.fsum(a * b for a, b in zip(embedding, candidate))
+        if score >= best_score:
+            best_digest, best_score = digest.decode('utf-8'), score
+    return best_digest, best_score
+
+async def redis_lookup_similar(project_id, embedding):
+    _, _, emb_key, _ = kb_cache_keys(project_id)
+    candidates = await redis_client.hgetall(emb_key)
+    best_digest, best_score = await asyncio.to_thread(best_embedding_match, embedding, candidates)
+    if best_digest is None:
+        return None, best_score
+    return await redis_lookup_answer(project_id, best_digest), best_score
 
-    return "Sorry, I didn't get your query."
+async def embed_query(query):
+    http = get_http_session()
+    async with http.post(
+        "https://api.openai.com/v1/embeddings",
+        json={"model": KB_CACHE_EMBEDDING_MODEL, "input": query, "dimensions": KB_CACHE_EMBEDDING_DIMENSIONS},
+        headers={"Authorization": f"Bearer {OPENAI_API_KEY}"},
+        timeout=aiohttp.ClientTimeout(total=CUSTOMGPT_TIMEOUT),
+    ) as response:
+        response.raise_for_status()
+        body = await response.json()
+    return body["data"][0]["embedding"]
 
-def create_session(api_key, project_id, caller_number):
+async def cached_additional_context(query, api_key, project_id, session_id):
+    if not KB_CACHE_ENABLED:
+        return await get_additional_context(query, api_key, project_id, session_id)
+
+    normalized = normalize_query(query)
+    digest = hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+    local_key = (int(project_id), digest)
+    answer = local_answer_cache.get(local_key)
+    if answer is not None:
+        KB_CACHE_EVENTS.labels(event="local_hits").inc()
+        logger.info(f"KB cache local hit::{project_id}::{digest}")
+        return answer
+
+    embedding = None
+    try:
+        answer = await redis_lookup_answer(project_id, digest)
+        if answer is None and KB_CACHE_SIMILARITY > 0:
+            embedding = await embed_query(normalized)
+            answer, score = await redis_lookup_similar(project_id, embedding)
+            if answer is not None:
+                logger.info(f"KB cache similar hit::{project_id}::{digest}::score {score:.3f}")
+                record_kb_cache_event(project_id, "similar_hits")
+        elif answer is not None:
+            logger.info(f"KB cache redis hit::{project_id}::{digest}")
+            record_kb_cache_event(project_id, "redis_hits")
+    except Exception as e:
+        logger.error(f"KB cache lookup failed::{project_id}::Error: {e!r}")
+
+    if answer is not None:
+        local_answer_cache.set(local_key, answer, kb_cache_ttl(project_id))
+        return answer
+
+    logger.info(f"KB cache miss::{project_id}::{digest}")
+    answer = await get_additional_context(query, api_key, project_id, session_id)
+    record_kb_cache_event(project_id, "misses")
+    if answer != KB_FALLBACK_ANSWER:
+        local_answer_cache.set(local_key, answer, kb_cache_ttl(project_id))
+        run_in_background(kb_cache_write(project_id, redis_store_answer(project_id, digest, answer, embedding)))
+    return answer
+
+class KnowledgePrefetch:
+    """A speculative knowledge-base lookup started from the caller's transcript before the model's function call."""
+
+    def __init__(self, transcript, item_id, api_key, project_id, prefetch_session):
+        self.transcript = transcript
+        # The caller's input item the transcript is of.
+        self.item_id = item_id
+        self.api_key = api_key
+        self.project_id = project_id
+        self.started_at = time.monotonic()
+        self.finished_at = None
+        logger.info(f"KB prefetch started::{project_id}::{transcript}")
+        self.task = asyncio.create_task(self.run(prefetch_session))
+
+    async def run(self, prefetch_session):
+        try:
+            return await cached_additional_context(self.transcript, self.api_key, self.project_id, await prefetch_session)
+        finally:
+            self.finished_at = time.monotonic()
+
+    def overlap(self, query):
+        transcript_words = set(normalize_query(self.transcript).split())
+        if not transcript_words:
+            return 0.0
+        return len(transcript_words & set(normalize_query(query).split())) / len(transcript_words)
+
+    def discard(self):
+        self.task.cancel()
+        KB_PREFETCH_EVENTS.labels(outcome='unused').inc()
+
+    async def adopt(self, query, session_id):
+        """The prefetched answer if the function call asks the same thing, else None (and the lookup is cancelled).
+
+        An adopted question is asked again in the call's own CustomGPT session, off the answer path,
+        so later answers there have it as context.
+        """
+        dispatched_at = time.monotonic()
+        overlap = self.overlap(query)
+        if overlap < KB_PREFETCH_MIN_OVERLAP:
+            self.task.cancel()
+            KB_PREFETCH_EVENTS.labels(outcome='mismatch').inc()
+            logger.info(f"KB prefetch mismatch::overlap {overlap:.2f}::{self.transcript}")
+            return None
+        try:
+            answer = await self.task
+        except Exception as e:
+            KB_PREFETCH_EVENTS.labels(outcome='failed').inc()
+            logger.error(f"KB prefetch failed::Error: {e!r}")
+            return None
+        if answer == KB_FALLBACK_ANSWER:
+            KB_PREFETCH_EVENTS.labels(outcome='failed').inc()
+            return None
+        saved = min(dispatched_at, self.finished_at) - self.started_at
+        run_in_background(get_additional_context(self.transcript, self.api_key, self.project_id, session_id))
+        KB_PREFETCH_EVENTS.labels(outcome='hit').inc()
+        KB_PREFETCH_SAVED.observe(saved)
+        logger.info(f"KB prefetch hit::overlap {overlap:.2f}::saved {saved:.3f} seconds")
+        return answer
+
+async def create_session(api_key, project_id, caller_number):
+    http = get_http_session()
     tries = 0
-    max_retries = 2
-    while tries <= max_retries:
+    while tries <= CUSTOMGPT_MAX_RETRIES:
         try:
-            CustomGPT.api_key = api_key
-            session = CustomGPT.Conversation.create(project_id=project_id, name=caller_number)
-            logger.info(f"CustomGPT Session Created::{session.parsed.data}");
-            return session.parsed.data.session_id
+            async with http.post(
+                f"{CUSTOMGPT_BASE_URL}/api/v1/projects/{project_id}/conversations",
+                json={"name": caller_number},
+                headers={"Authorization": f"Bearer {api_key}", "Accept": "application/json"},
+                timeout=aiohttp.ClientTimeout(total=CUSTOMGPT_TIMEOUT),
+            ) as response:
+                response.raise_for_status()
+                body = await response.json()
+            logger.info(f"CustomGPT Session Created::{body['data']}")
+            return body["data"]["session_id"]
         except Exception as e:
-            logger.error(f"Error in create_session::Try {tries}::Error: {e}")
+            logger.error(f"Error in create_session::Try {tries}::Error: {e!r}")
         tries += 1
+        if tries <= CUSTOMGPT_MAX_RETRIES:
+            await asyncio.sleep(customgpt_retry_delay(tries))
+
+    return None
+
+async def create_prefetch_session(api_key, project_id):
+    return await create_session(api_key, project_id, "Knowledge-base prefetch") or str(uuid.uuid4())
+
+# CustomGPT sessions being created for calls answered by this worker, keyed by the call's session_id.
+pending_customgpt_sessions = {}
+
+def customgpt_session_key(session_id: str) -> str:
+    return f"call:{session_id}:customgpt_session"
+
+async def publish_customgpt_session(session_id, conversation_id):
+    """Record the call's CustomGPT session for every worker; the first one recorded wins."""
+    key = customgpt_session_key(session_id)
+    try:
+        if await redis_client.set(key, conversation_id, nx=True, ex=CALL_STATE_TTL):
+            return conversation_id
+        existing = await redis_client.get(key)
+        if existing:
+            return existing.decode('utf-8')
+    except Exception as e:
+        logger.error(f"Publishing CustomGPT session failed. Session ID: {session_id}. Error: {e!r}")
+    return conversation_id
+
+async def create_call_session(session_id, api_key, project_id, caller_number):
+    conversation_id = await create_session(api_key, project_id, caller_number) or str(uuid.uuid4())
+    return await publish_customgpt_session(session_id, conversation_id)
+
+def start_customgpt_session(session_id, api_key, project_id, caller_number):
+    task = asyncio.create_task(create_call_session(session_id, api_key, project_id, caller_number))
+    pending_customgpt_sessions[session_id] = task
+    # Streams arrive within the same window a pre-warmed realtime session waits for them.
+    asyncio.get_running_loop().call_later(REALTIME_PREWARM_TIMEOUT, reap_customgpt_session, session_id, task)
+
+def reap_customgpt_session(session_id, task):
+    if pending_customgpt_sessions.get(session_id) is not task:
+        return
+    del pending_customgpt_sessions[session_id]
+    # A creation still running may yet publish the session for the worker that got the stream.
+    keep_until_done(task)
+
+    def report(task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Creating CustomGPT session failed. Session ID: {session_id}. Error: {task.exception()!r}")
+
+    task.add_done_callback(report)
+
+async def resolve_customgpt_session(session_id):
+    """The call's CustomGPT session, created by this worker or published by the one that took the webhook."""
+    task = pending_customgpt_sessions.pop(session_id, None)
+    if task is not None:
+        return await task
+    key = customgpt_session_key(session_id)
+    deadline = time.monotonic() + CUSTOMGPT_SESSION_WAIT
+    try:
+        while True:
+            existing = await redis_client.get(key)
+            if existing:
+                return existing.decode('utf-8')
+            if time.monotonic() >= deadline:
+                break
+            await asyncio.sleep(0.1)
+    except Exception as e:
+        logger.error(f"CustomGPT session lookup failed. Session ID: {session_id}. Error: {e!r}")
+    logger.error(f"No CustomGPT session for the call in time, using a fallback. Session ID: {session_id}")
+    return await publish_customgpt_session(session_id, str(uuid.uuid4()))
+
+# SMS session lookups in flight on this worker, so a burst from one caller shares a single one.
+pending_sms_sessions = {}
+
+def sms_session_keys(project_id, caller_number):
+    prefix = f"sms:{project_id}"
+    return f"{prefix}:session:{caller_number}", f"{prefix}:creating:{caller_number}", f"{prefix}:stats"
+
+async def record_sms_session_event(project_id, event):
+    SMS_SESSION_EVENTS.labels(event=event).inc()
+    _, _, stats_key = sms_session_keys(project_id, None)
+    try:
+        await redis_client.hincrby(stats_key, event, 1)
+    except Exception as e:
+        logger.error(f"SMS session stats update failed::{project_id}::Error: {e!r}")
+
+async def sms_session(api_key, project_id, caller_number):
+    """The caller's CustomGPT session for this project, reused across messages."""
+    if caller_number == 'Unknown':
+        return await create_session(api_key, project_id, caller_number) or str(uuid.uuid4())
+    session_key, _, _ = sms_session_keys(project_id, caller_number)
+    task = pending_sms_sessions.get(session_key)
+    if task is None:
+        task = asyncio.create_task(lookup_or_create_sms_session(api_key, project_id, caller_number))
+        pending_sms_sessions[session_key] = task
+        task.add_done_callback(lambda _: pending_sms_sessions.pop(session_key, None))
+    else:
+        await record_sms_session_event(project_id, "joined")
+    return await asyncio.shield(task)
+
+async def lookup_or_create_sms_session(api_key, project_id, caller_number):
+    session_key, creating_key, _ = sms_session_keys(project_id, caller_number)
+    try:
+        # GETEX slides the TTL forward on every message from the caller.
+        existing = await redis_client.getex(session_key, ex=SMS_SESSION_TTL)
+        if existing:
+            await record_sms_session_event(project_id, "hits")
+            return existing.decode('utf-8')
+        # Only the worker holding the creation lock calls CustomGPT; the others wait for its result.
+        if not await redis_client.set(creating_key, 1, nx=True, ex=int(CUSTOMGPT_SESSION_WAIT) + 1):
+            deadline = time.monotonic() + CUSTOMGPT_SESSION_WAIT
+            while time.monotonic() < deadline:
+                await asyncio.sleep(0.1)
+                existing = await redis_client.getex(session_key, ex=SMS_SESSION_TTL)
+                if existing:
+                    await record_sms_session_event(project_id, "joined")
+                    return existing.decode('utf-8')
+        await record_sms_session_event(project_id, "misses")
+    except Exception as e:
+        logger.error(f"SMS session lookup failed::{project_id}::{caller_number}::Error: {e!r}")
+        await record_sms_session_event(project_id, "errors")
+
+    session_id = await create_session(api_key, project_id, caller_number)
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            # A fallback id has no conversation behind it, so it is used once and never cached.
+            if session_id is not None:
+                pipe.set(session_key, session_id, ex=SMS_SESSION_TTL)
+            pipe.delete(creating_key)
+            await pipe.execute()
+    except Exception as e:
+        logger.error(f"SMS session store failed::{project_id}::{caller_number}::Error: {e!r}")
+    return session_id or str(uuid.uuid4())
+
+# Realtime sessions opened during /incoming-call, keyed by session_id, waiting for their media stream.
+# The registry is per worker: a stream that lands on another worker simply connects fresh.
+prewarmed_sessions = {}
+
+async def connect_realtime():
+    return await websockets.connect(
+        REALTIME_URL,
+        extra_headers={
+            "Authorization": f"Bearer {OPENAI_API_KEY}",
+            "OpenAI-Beta": "realtime=v1"
+        }
+    )
+
+async def open_prewarmed_session(session_id, phone_number, introduction):
+    openai_ws = await connect_realtime()
+    try:
+        await send_session_update(openai_ws, phone_number, introduction)
+        while True:
+            event = json.loads(await openai_ws.recv())
+            if event['type'] == 'session.updated':
+                logger.info(f"Realtime session pre-warmed. Session ID: {session_id}")
+                return openai_ws
+            if event['type'] == 'error':
+                raise Exception(f"Realtime session.update failed: {event}")
+    except BaseException:
+        await openai_ws.close()
+        raise
+
+def prewarm_realtime_session(session_id, phone_number, introduction):
+    task = asyncio.create_task(open_prewarmed_session(session_id, phone_number or '', introduction))
+    prewarmed_sessions[session_id] = task
+    asyncio.get_running_loop().call_later(REALTIME_PREWARM_TIMEOUT, reap_prewarmed_session, session_id, task)
 
-    session_id = uuid.uuid4()
-    return session_id
+def reap_prewarmed_session(session_id, task):
+    if prewarmed_sessions.get(session_id) is not task:
+        return
+    del prewarmed_sessions[session_id]
+    logger.info(f"Reaping orphaned pre-warmed realtime session. Session ID: {session_id}")
+    # Mostly streams that landed on another worker, each having held a realtime socket until now.
+    REALTIME_PREWARMS.labels(outcome='reaped').inc()
+    if not task.done():
+        task.cancel()
+    elif not task.cancelled() and task.exception() is None:
+        run_in_background(task.result().close())
+
+async def adopt_prewarmed_session(session_id):
+    task = prewarmed_sessions.pop(session_id, None)
+    if task is None:
+        REALTIME_PREWARMS.labels(outcome='missing').inc()
+        return None
+    try:
+        openai_ws = await task
+    except Exception as e:
+        REALTIME_PREWARMS.labels(outcome='failed').inc()
+        logger.error(f"Pre-warmed realtime session failed, connecting fresh. Session ID: {session_id}. Error: {e!r}")
+        return None
+    REALTIME_PREWARMS.labels(outcome='adopted').inc()
+    return openai_ws
+
+@asynccontextmanager
+async def realtime_session(session_id, phone_number, introduction):
+    openai_ws = await adopt_prewarmed_session(session_id)
+    if openai_ws is None:
+        openai_ws = await connect_realtime()
+        await send_session_update(openai_ws, phone_number, introduction)
+    else:
+        logger.info(f"Adopted pre-warmed realtime session. Session ID: {session_id}")
+    try:
+        yield openai_ws
+    finally:
+        await openai_ws.close()
 
 async def send_session_update(openai_ws, phone_number, introduction):
     introduction = introduction.replace('+', ' ')
@@ -459,6 +2002,7 @@ async def send_session_update(openai_ws, phone_number, introduction):
             "instructions": SYSTEM_MESSAGE.format(phone_number=phone_number, introduction=introduction),
             "modalities": ["text", "audio"],
             "temperature": 0.8,
+            **({"input_audio_transcription": {"model": INPUT_TRANSCRIPTION_MODEL}} if KB_PREFETCH_ENABLED else {}),
             "tools": [
                 {
                   "type": "function",
@@ -483,9 +2027,11 @@ async def send_session_update(openai_ws, phone_number, introduction):
             ]
         }
     }
-    logger.info('Sending session update: %s', json.dumps(session_update))
+    logger.info('Sending session update: %s', LogPayload(session_update['session'], ('voice', 'turn_detection', 'modalities', 'instructions')))
     await openai_ws.send(json.dumps(session_update))
-    time.sleep(1)
+
+async def send_introduction(openai_ws, introduction):
+    introduction = introduction.replace('+', ' ')
     initial_response = {
         "type": "conversation.item.create",
         "item": {
@@ -502,24 +2048,252 @@ async def send_session_update(openai_ws, phone_number, introduction):
     await openai_ws.send(json.dumps(initial_response))
     await openai_ws.send(json.dumps({"type": "response.create", "response": { "instructions": f"Introduce yourself as {introduction}"} }))
 
-async def play_typing(websocket, stream_sid):
-    with open(mp3_file_path, "rb") as mp3_file:
-        mp3_data = mp3_file.read()
-        base64_audio = base64.b64encode(mp3_data).decode('utf-8')
+# Pre-serialized pieces of the two relay messages. base64 never needs JSON escaping, so payloads are
+# spliced in verbatim instead of being decoded, re-encoded and re-serialized.
+MEDIA_SUFFIX = '"}}'
+AUDIO_APPEND_PREFIX = '{"type":"input_audio_buffer.append","audio":"'
+AUDIO_APPEND_SUFFIX = '"}'
+TWILIO_MEDIA_EVENT = '{"event":"media"'
+ULAW_FRAME_BYTES = 160
+ULAW_BYTES_PER_SECOND = 8000
+# Outbound audio is paced in 60 ms frames: 480 bytes is the smallest multiple of a 20 ms frame that
+# is also a multiple of 3 bytes, so base64 payloads can be sliced into frames without re-encoding.
+OUTBOUND_FRAME_BYTES = 480
+OUTBOUND_FRAME_CHARS = OUTBOUND_FRAME_BYTES // 3 * 4
+TWILIO_PAYLOAD_FIELD = '"payload":"'
+REALTIME_DELTA_EVENT = '{"type":"response.audio.delta"'
+REALTIME_DELTA_FIELD = '"delta":"'
 
-    audio_delta = {
-        "event": "media",
-        "streamSid": stream_sid,
-        "media": {
-            "payload": base64_audio
+def twilio_media_prefix(stream_sid):
+    return '{"event":"media","streamSid":' + json_dumps(stream_sid) + ',"media":{"payload":"'
+
+def audio_append_message(payload):
+    return AUDIO_APPEND_PREFIX + payload + AUDIO_APPEND_SUFFIX
+
+def extract_string_field(message, field):
+    start = message.find(field)
+    if start < 0:
+        return None
+    start += len(field)
+    end = message.find('"', start)
+    return message[start:end] if end > start else None
+
+def twilio_media_payload(message):
+    """Payload of a compact Twilio media event, or None when the message needs a full parse."""
+    if not message.startswith(TWILIO_MEDIA_EVENT):
+        return None
+    return extract_string_field(message, TWILIO_PAYLOAD_FIELD)
+
+def realtime_audio_delta(message):
+    """Delta of a compact response.audio.delta event, or None when the message needs a full parse."""
+    if not message.startswith(REALTIME_DELTA_EVENT):
+        return None
+    return extract_string_field(message, REALTIME_DELTA_FIELD)
+
+def ulaw_to_linear_table():
+    # G.711 mu-law expansion of every code to 16-bit linear PCM.
+    codes = ~np.arange(256, dtype=np.uint8)
+    exponent = (codes >> 4) & 0x07
+    magnitude = (((codes & 0x0F).astype(np.int32) << 3) + 0x84 << exponent) - 0x84
+    return np.where(codes & 0x80, -magnitude, magnitude).astype(np.int16)
+
+ULAW_TO_LINEAR = ulaw_to_linear_table()
+# Squared sample value per code, so frame energy is one table lookup and a mean.
+ULAW_POWER = ULAW_TO_LINEAR.astype(np.float64) ** 2
+ULAW_LEVELS_ORDER = np.argsort(ULAW_TO_LINEAR, kind='stable').astype(np.uint8)
+ULAW_LEVELS = ULAW_TO_LINEAR[ULAW_LEVELS_ORDER].astype(np.int32)
+
+def frame_power_dbfs(raw):
+    """RMS level in dBFS of each whole 20 ms frame in a g711_ulaw buffer."""
+    codes = np.frombuffer(raw, dtype=np.uint8, count=len(raw) // ULAW_FRAME_BYTES * ULAW_FRAME_BYTES)
+    power = ULAW_POWER[codes.reshape(-1, ULAW_FRAME_BYTES)].mean(axis=1)
+    return 10 * np.log10(np.maximum(power, 1.0) / 32768.0 ** 2)
+
+def linear_to_ulaw(samples):
+    """Nearest g711_ulaw code for each 16-bit linear PCM sample."""
+    samples = np.asarray(samples, dtype=np.int32)
+    upper = np.clip(np.searchsorted(ULAW_LEVELS, samples), 1, 255)
+    nearer_lower = samples - ULAW_LEVELS[upper - 1] < ULAW_LEVELS[upper] - samples
+    return ULAW_LEVELS_ORDER[upper - nearer_lower].tobytes()
+
+class LocalVad:
+    """Energy-based voice activity detection on one caller's g711_ulaw frames.
+
+    process() reports speech onset after LOCAL_VAD_ONSET_FRAMES voiced frames and, with
+    LOCAL_VAD_SUPPRESS_SILENCE, withholds silence beyond the hangover. The last
+    LOCAL_VAD_PREFIX_MS of withheld audio is returned with the frame that ends it, so the
+    realtime API still hears the start of the utterance.
+    """
+
+    def __init__(self):
+        self.threshold = LOCAL_VAD_THRESHOLD_DBFS
+        self.hangover_frames = LOCAL_VAD_HANGOVER_MS // 20
+        self.voiced_run = 0
+        self.frames_since_voice = self.hangover_frames
+        self.speaking = False
+        self.prefix = deque(maxlen=max(1, LOCAL_VAD_PREFIX_MS // 20))
+        # Frames in the audio last returned by process().
+        self.frames_forwarded = 1
+        # time.monotonic() of the last onset, until the realtime API's speech_started matches it.
+        self.onset_at = None
+
+    def process(self, raw):
+        """(g711_ulaw to forward or None, whether the caller just started speaking)."""
+        voiced = frame_power_dbfs(raw)[0] >= self.threshold if len(raw) >= ULAW_FRAME_BYTES else False
+        speech_started = False
+        if voiced:
+            self.voiced_run += 1
+            self.frames_since_voice = 0
+            if not self.speaking and self.voiced_run >= LOCAL_VAD_ONSET_FRAMES:
+                self.speaking = True
+                self.onset_at = time.monotonic()
+                speech_started = True
+        else:
+            self.voiced_run = 0
+            self.frames_since_voice += 1
+            if self.frames_since_voice >= self.hangover_frames:
+                self.speaking = False
+        if not LOCAL_VAD_SUPPRESS_SILENCE:
+            return raw, speech_started
+        if self.frames_since_voice > self.hangover_frames:
+            self.prefix.append(raw)
+            return None, speech_started
+        self.frames_forwarded = 1
+        if self.prefix:
+            self.prefix.append(raw)
+            self.frames_forwarded = len(self.prefix)
+            raw = b"".join(self.prefix)
+            self.prefix.clear()
+        return raw, speech_started
+
+def greeting_cache_key(project_id, introduction):
+    # Content-addressed: any change to the project, introduction, voice or model yields a new entry.
+    identity = json.dumps([int(project_id), introduction.replace('+', ' '), VOICE, REALTIME_URL])
+    return "greeting:" + hashlib.sha256(identity.encode('utf-8')).hexdigest()
+
+async def load_cached_greeting(greeting_key):
+    if not GREETING_CACHE_ENABLED:
+        return None
+    try:
+        audio, transcript = await redis_client.hmget(greeting_key, "audio", "transcript")
+    except Exception as e:
+        logger.error(f"Greeting cache lookup failed::{greeting_key}::Error: {e!r}")
+        return None
+    if not audio or not transcript:
+        return None
+    logger.info(f"Greeting cache hit::{greeting_key}")
+    return {"audio": audio, "transcript": transcript.decode('utf-8')}
+
+async def store_cached_greeting(greeting_key, deltas, transcript):
+    # Raw g711_ulaw is a quarter smaller than the base64 deltas it arrived as.
+    audio = b"".join(base64.b64decode(delta) for delta in deltas)
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.hset(greeting_key, mapping={"audio": audio, "transcript": transcript})
+            pipe.expire(greeting_key, GREETING_CACHE_TTL)
+            await pipe.execute()
+        logger.info(f"Greeting cached::{greeting_key}::{len(audio)} bytes")
+    except Exception as e:
+        logger.error(f"Greeting cache store failed::{greeting_key}::Error: {e!r}")
+
+async def send_cached_introduction(openai_ws, greeting):
+    # The caller hears the cached audio, so record that same greeting as the assistant's first turn
+    # instead of asking the model to generate it again.
+    await openai_ws.send(json.dumps({
+        "type": "conversation.item.create",
+        "item": {
+            "type": "message",
+            "role": "user",
+            "content": [{"type": "text", "text": "Introduce yourself"}]
         }
-    }
-    await websocket.send_json(audio_delta)
+    }))
+    await openai_ws.send(json.dumps({
+        "type": "conversation.item.create",
+        "item": {
+            "type": "message",
+            "role": "assistant",
+            "content": [{"type": "text", "text": greeting["transcript"]}]
+        }
+    }))
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_MULAW = 7
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+def read_wav_as_ulaw(path):
+    """A WAV file's audio as 8 kHz mono g711_ulaw bytes.
+
+    The wave module cannot read u-law files, so the RIFF chunks are walked here. 8 kHz mono u-law
+    is used as it is; other u-law and 16-bit PCM files are mixed to mono, resampled and encoded.
+    """
+    with open(path, "rb") as wav_file:
+        data = wav_file.read()
+    if data[:4] != b'RIFF' or data[8:12] != b'WAVE':
+        raise ValueError(f"{path} is not a WAV file")
+    fmt, audio, offset = None, None, 12
+    while offset + 8 <= len(data):
+        chunk_id, size = data[offset:offset + 4], struct.unpack_from('<I', data, offset + 4)[0]
+        if chunk_id == b'fmt ':
+            fmt = data[offset + 8:offset + 8 + size]
+        elif chunk_id == b'data':
+            audio = data[offset + 8:offset + 8 + size]
+        offset += 8 + size + (size & 1)
+    if fmt is None or audio is None:
+        raise ValueError(f"{path} has no fmt or data chunk")
+    format_tag, channels, rate, _, _, bits = struct.unpack_from('<HHIIHH', fmt)
+    if format_tag == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+        format_tag = struct.unpack_from('<H', fmt, 24)[0]
+    if format_tag == WAVE_FORMAT_MULAW and bits == 8:
+        if channels == 1 and rate == ULAW_BYTES_PER_SECOND:
+            return audio
+        samples = ULAW_TO_LINEAR[np.frombuffer(audio, dtype=np.uint8)]
+    elif format_tag == WAVE_FORMAT_PCM and bits == 16:
+        samples = np.frombuffer(audio[:len(audio) // 2 * 2], dtype='<i2')
+    else:
+        raise ValueError(f"{path}: only 8-bit u-law and 16-bit PCM WAV files are supported")
+    samples = samples[:len(samples) // channels * channels].reshape(-1, channels).mean(axis=1)
+    if rate != ULAW_BYTES_PER_SECOND:
+        duration = len(samples) / rate
+        samples = np.interp(np.arange(0, duration, 1 / ULAW_BYTES_PER_SECOND), np.arange(len(samples)) / rate, samples)
+    return linear_to_ulaw(np.round(samples))
 
-async def clear_buffer(websocket, openai_ws, stream_sid):
+def hold_clip_frames(path):
+    """The clip as base64 outbound frames, the last padded with silence so the loop stays in step."""
+    audio = read_wav_as_ulaw(path)
+    audio += b'\xff' * (-len(audio) % OUTBOUND_FRAME_BYTES)
+    return tuple(
+        base64.b64encode(audio[offset:offset + OUTBOUND_FRAME_BYTES]).decode('utf-8')
+        for offset in range(0, len(audio), OUTBOUND_FRAME_BYTES)
+    )
+
+# Hold clips by project (None for the default), encoded once per worker and shared by every call.
+hold_clips = {}
+
+@app.on_event("startup")
+def load_hold_clips():
+    frames_by_path = {}
+    for project_id, path in [(None, HOLD_AUDIO_FILE)] + list(HOLD_AUDIO_PROJECT_FILES.items()):
+        if not path:
+            continue
+        try:
+            if path not in frames_by_path:
+                frames_by_path[path] = hold_clip_frames(path)
+            hold_clips[project_id] = frames_by_path[path]
+        except Exception as e:
+            logger.error(f"Loading hold audio {path} failed: {e!r}")
+
+def hold_audio_frames(project_id):
+    return hold_clips.get(int(project_id), hold_clips.get(None))
+
+async def clear_playback(websocket, stream_sid, outbound=None):
+    if outbound is not None:
+        outbound.flush()
     audio_delta = {
       'streamSid': stream_sid,
       'event': 'clear',
     }
-    await openai_ws.send(json.dumps({"type": "response.cancel"}))
     await websocket.send_json(audio_delta)
+
+async def clear_buffer(websocket, openai_ws, stream_sid, outbound=None):
+    await clear_playback(websocket, stream_sid, outbound)
+    await openai_ws.send(json.dumps({"type": "response.cancel"}))
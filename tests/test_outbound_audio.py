@@ -0,0 +1,87 @@
+import asyncio
+import base64
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+for name, value in {
+    "REDIS_URL": "redis://localhost:6379",
+    "TWILIO_ACCOUNT_SID": "AC" + "0" * 32,
+    "TWILIO_AUTH_TOKEN": "test",
+    "OPENAI_API_KEY": "test",
+}.items():
+    os.environ.setdefault(name, value)
+
+import main  # noqa: E402
+
+FRAMES = 12
+
+
+class TwilioSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, message):
+        self.sent.append(message)
+
+
+class Metrics:
+    def __init__(self):
+        self.frames = 0
+
+    def audio_sent(self, frames):
+        self.frames += frames
+
+
+def answer_frames():
+    """Distinct outbound frames, told apart by their first byte."""
+    return [base64.b64encode(bytes([index]) * main.OUTBOUND_FRAME_BYTES).decode('utf-8') for index in range(FRAMES)]
+
+
+def played(twilio):
+    return [base64.b64decode(message.split('"payload":"')[1].split('"')[0])[0] for message in twilio.sent]
+
+
+def test_unconfirmed_local_onset_loses_no_frames():
+    async def call():
+        twilio, metrics = TwilioSocket(), Metrics()
+        outbound = main.OutboundAudio(twilio, metrics)
+        # The realtime API delivers the answer faster than it plays.
+        await outbound.put("".join(answer_frames()))
+        await asyncio.sleep(0.3)
+        sent_before_pause = len(twilio.sent)
+        outbound.pause(0.2)
+        assert outbound.playing()
+        await asyncio.sleep(0.1)
+        assert len(twilio.sent) == sent_before_pause
+        deadline = time.monotonic() + 5
+        while outbound.frames and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        outbound.close()
+        return twilio, metrics
+
+    twilio, metrics = asyncio.run(call())
+    order = played(twilio)
+    # Frames Twilio was still holding are sent again, then the answer carries on in order.
+    assert len(order) > FRAMES
+    assert sorted(set(order)) == list(range(FRAMES))
+    assert order[-1] == FRAMES - 1
+    assert metrics.frames == FRAMES * main.OUTBOUND_FRAME_BYTES // main.ULAW_FRAME_BYTES
+
+
+def test_confirmed_barge_in_drops_the_rest_of_the_answer():
+    async def call():
+        twilio = TwilioSocket()
+        outbound = main.OutboundAudio(twilio, Metrics())
+        await outbound.put("".join(answer_frames()))
+        await asyncio.sleep(0.3)
+        outbound.pause(5)
+        outbound.flush()
+        await asyncio.sleep(0.1)
+        outbound.close()
+        return twilio, outbound
+
+    twilio, outbound = asyncio.run(call())
+    assert not outbound.frames
+    assert len(played(twilio)) < FRAMES
@@ -0,0 +1,53 @@
+import os
+import re
+import sys
+import urllib.parse
+
+import pytest
+from starlette.testclient import TestClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+for name, value in {
+    "REDIS_URL": "redis://localhost:6379",
+    "TWILIO_ACCOUNT_SID": "AC" + "0" * 32,
+    "TWILIO_AUTH_TOKEN": "test",
+    "OPENAI_API_KEY": "test",
+}.items():
+    os.environ.setdefault(name, value)
+
+import main  # noqa: E402
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(main, "OVERFLOW_ACTION", "hold")
+    monkeypatch.setattr(main, "OVERFLOW_MAX_ATTEMPTS", 3)
+    monkeypatch.setattr(main, "PERSONAL_PHONE_NUMBER", "+15559999")
+    monkeypatch.setattr(main, "start_customgpt_session", lambda *args: None)
+    monkeypatch.setattr(main, "prewarm_realtime_session", lambda *args: None)
+    monkeypatch.setattr(main, "schedule_recording", lambda *args: None)
+
+    async def overflow_state(session_id):
+        return main.CallState.OVERFLOW
+
+    # Every media stream is turned away, as by MAX_CALLS_PER_WORKER or a draining worker.
+    monkeypatch.setattr(main, "get_call_state", overflow_state)
+    return TestClient(main.app)
+
+
+def redirect(twiml):
+    """Path and query of the TwiML's Redirect."""
+    url = urllib.parse.urlsplit(re.search(r"<Redirect>(.*?)</Redirect>", twiml).group(1).replace("&amp;", "&"))
+    return f"{url.path}?{url.query}"
+
+
+def test_refused_streams_count_toward_overflow_max_attempts(client):
+    incoming_call = "/incoming-call?project_id=1&api_key=k&phone_number=%2B15550001&introduction=Hi"
+    for attempt in range(main.OVERFLOW_MAX_ATTEMPTS):
+        end_stream = redirect(client.post(incoming_call, data={"From": "+1"}).text)
+        twiml = client.post(end_stream).text
+        assert (main.OVERFLOW_HOLD_MESSAGE in twiml) == (attempt == 0)
+        incoming_call = redirect(twiml)
+        assert urllib.parse.parse_qs(incoming_call.split("?", 1)[1])["overflow_attempt"] == [str(attempt + 1)]
+    end_stream = redirect(client.post(incoming_call, data={"From": "+1"}).text)
+    assert "<Dial>+15559999</Dial>" in client.post(end_stream).text